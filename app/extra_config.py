@@ -20,8 +20,12 @@ FBAN_SUDO_TRIGGER: str = getenv("FBAN_SUDO_TRIGGER")
 
 GEMINI_API_KEY: str = getenv("GEMINI_API_KEY")
 
+GEMINI_RPM: int = int(getenv("GEMINI_RPM", 15))
+
 LOAD_HANDLERS: bool = True
 
+LOG_ARCHIVE_DAYS: int = int(getenv("LOG_ARCHIVE_DAYS", 30))
+
 MESSAGE_LOGGER_CHAT: int = int(getenv("MESSAGE_LOGGER_CHAT") or getenv("LOG_CHAT"))
 
 PM_GUARD: bool = False
@@ -30,8 +34,16 @@ PM_LOGGER: bool = False
 
 PM_LOGGER_THREAD_ID: int = int(getenv("PM_LOGGER_THREAD_ID", 0)) or None
 
+PM_SPAM_THRESHOLD: int = max(1, int(getenv("PM_SPAM_THRESHOLD", 5)))
+
+PM_SPAM_WINDOW: int = int(getenv("PM_SPAM_WINDOW", 300))
+
 TAG_LOGGER: bool = False
 
+TAG_LOGGER_ALIASES: list[str] = [
+    alias.strip() for alias in getenv("TAG_LOGGER_ALIASES", "").split(",") if alias.strip()
+]
+
 TAG_LOGGER_THREAD_ID: int = int(getenv("TAG_LOGGER_THREAD_ID", 0)) or None
 
 UPSTREAM_REPO: str = getenv("UPSTREAM_REPO", "https://github.com/thedragonsinn/plain-ub")
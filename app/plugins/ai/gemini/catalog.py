@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from app import LOGGER, Config
+from app.plugins.ai.gemini import DB_SETTINGS, AIConfig, async_client
+
+
+async def init_task():
+    if async_client is None:
+        return
+    await ModelCatalog.load()
+    Config.BACKGROUND_TASKS.append(
+        asyncio.create_task(catalog_refresher(), name="gemini_model_catalog")
+    )
+
+
+class ModelCatalog:
+    """Gemini models supporting generateContent, cached in DB for MODEL_CATALOG_TTL."""
+
+    models: list[str] = []
+    updated_at: float = 0
+
+    @classmethod
+    def time_left(cls) -> float:
+        return cls.updated_at + AIConfig.MODEL_CATALOG_TTL - time.time()
+
+    @classmethod
+    async def load(cls):
+        catalog = await DB_SETTINGS.find_one({"_id": "gemini_model_catalog"}) or {}
+        cls.models = catalog.get("models", [])
+        cls.updated_at = catalog.get("updated_at", 0)
+
+    @classmethod
+    async def refresh(cls):
+        cls.models = [
+            model.name.removeprefix("models/")
+            async for model in await async_client.models.list(config={"query_base": True})
+            if "generateContent" in (model.supported_actions or [])
+        ]
+        cls.updated_at = time.time()
+        await DB_SETTINGS.add_data(
+            {"_id": "gemini_model_catalog", "models": cls.models, "updated_at": cls.updated_at}
+        )
+
+    @classmethod
+    async def get_models(cls) -> list[str]:
+        if not cls.models:
+            await cls.refresh()
+        return cls.models
+
+
+async def catalog_refresher():
+    while True:
+        if ModelCatalog.time_left() <= 0:
+            try:
+                await ModelCatalog.refresh()
+            except Exception as e:
+                LOGGER.error(f"Failed to refresh Gemini model list: {e}")
+                await asyncio.sleep(600)
+                continue
+
+        await asyncio.sleep(ModelCatalog.time_left())
@@ -1,11 +1,11 @@
 import pickle
 from io import BytesIO
 
-from google.genai.chats import AsyncChat
 from pyrogram.enums import ChatType, ParseMode
 
 from app import BOT, Convo, Message, bot
-from app.plugins.ai.gemini import AIConfig, Response, async_client
+from app.plugins.ai.gemini import AIConfig, Response
+from app.plugins.ai.gemini.context_cache import CachedChat
 from app.plugins.ai.gemini.utils import create_prompts, run_basic_check
 
 
@@ -26,8 +26,9 @@ async def ai_chat(bot: BOT, message: Message):
         After 5 mins of Idle bot will export history and stop chat.
         use .load_history to continue
 
+        Older turns of long chats are automatically cached on Gemini's side.
     """
-    chat = async_client.chats.create(**AIConfig.get_kwargs(message.flags))
+    chat = CachedChat(**AIConfig.get_kwargs(message.flags))
     await do_convo(chat=chat, message=message)
 
 
@@ -56,18 +57,18 @@ async def history_chat(bot: BOT, message: Message):
 
     doc = await reply.download(in_memory=True)
     doc.seek(0)
-    pickle.load(doc)
+    history = pickle.load(doc)
 
     await resp.edit("__History Loaded... Resuming chat__")
 
-    chat = async_client.chats.create(**AIConfig.get_kwargs(message.flags))
+    chat = CachedChat(**AIConfig.get_kwargs(message.flags), history=history)
     await do_convo(chat=chat, message=message)
 
 
 CONVO_CACHE: dict[str, Convo] = {}
 
 
-async def do_convo(chat: AsyncChat, message: Message):
+async def do_convo(chat: CachedChat, message: Message):
     chat_id = message.chat.id
 
     old_conversation = CONVO_CACHE.get(message.unique_chat_user_id)
@@ -118,6 +119,7 @@ async def do_convo(chat: AsyncChat, message: Message):
         await export_history(chat, message)
     finally:
         CONVO_CACHE.pop(message.unique_chat_user_id, 0)
+        await chat.delete_cache()
 
 
 async def send_and_get_resp(
@@ -140,18 +142,19 @@ async def send_and_get_resp(
         await convo_obj.send_photo(photo=response.image_file, reply_to_id=reply_to_id)
 
     if response.audio:
+        audio_file = await response.get_audio_file()
         await convo_obj.send_voice(
-            voice=response.audio_file,
-            waveform=response.audio_file.waveform,
+            voice=audio_file,
+            waveform=audio_file.waveform,
             reply_to_id=reply_to_id,
-            duration=response.audio_file.duration,
+            duration=audio_file.duration,
         )
 
     return await convo_obj.get_response()
 
 
-async def export_history(chat: AsyncChat, message: Message):
-    doc = BytesIO(pickle.dumps(chat._curated_history))
+async def export_history(chat: CachedChat, message: Message):
+    doc = BytesIO(pickle.dumps(chat.history))
     doc.name = "AI_Chat_History.pkl"
     caption = Response(await chat.send_message("Summarize our Conversation into one line.")).text()
     await bot.send_document(chat_id=message.from_user.id, document=doc, caption=caption)
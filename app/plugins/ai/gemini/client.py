@@ -1,5 +1,8 @@
+import asyncio
 import io
 import logging
+import re
+import subprocess
 import wave
 
 import numpy as np
@@ -43,6 +46,8 @@ class Response:
         else:
             self._inline_data = None
 
+        self._audio_file: io.BytesIO | None = None
+
         self.is_empty = not self.first_parts
         self.failed_str = "`Error: Query Failed.`"
 
@@ -96,6 +101,17 @@ class Response:
 
         return None
 
+    @staticmethod
+    def get_waveform(samples: np.ndarray, sample_width: int, bars: int = 80) -> bytes:
+        chunk_size = max(1, len(samples) // bars)
+        n_chunks = min(bars, len(samples) // chunk_size)
+
+        # reshape returns a view, the PCM buffer isn't copied.
+        chunks = samples[: n_chunks * chunk_size].reshape(n_chunks, chunk_size)
+        levels = np.abs(chunks, dtype=np.float32).mean(axis=1) / 2 ** (8 * sample_width - 1) * 255
+
+        return np.minimum(levels, 255).astype(np.uint8).tobytes()
+
     @staticmethod
     def save_wave_file(pcm, channels=1, rate=24000, sample_width=2) -> io.BytesIO:
         file = io.BytesIO()
@@ -106,32 +122,39 @@ class Response:
             wf.setframerate(rate)
             wf.writeframes(pcm)
 
-        n_samples = len(pcm) // (sample_width * channels)
-        duration = n_samples / rate
+        file.name = "audio.ogg"
+        return file
+
+    @staticmethod
+    def encode_opus(pcm, channels=1, rate=24000, sample_width=2) -> bytes | None:
+        pcm_format = {1: "s8", 2: "s16le", 4: "s32le"}[sample_width]
+        cmd = (
+            f"ffmpeg -hide_banner -loglevel error "
+            f"-f {pcm_format} -ar {rate} -ac {channels} -i pipe:0 "
+            f"-c:a libopus -b:a 32k -application voip -f ogg pipe:1"
+        ).split()
+        try:
+            process = subprocess.run(cmd, input=pcm, capture_output=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return process.stdout if process.returncode == 0 else None
+
+    @staticmethod
+    async def save_voice_file(pcm, channels=1, rate=24000, sample_width=2) -> io.BytesIO:
+        opus_data = await asyncio.to_thread(Response.encode_opus, pcm, channels, rate, sample_width)
+
+        if opus_data:
+            file = io.BytesIO(opus_data)
+            file.name = "audio.ogg"
+        else:
+            # ffmpeg unavailable, send raw wave instead.
+            file = Response.save_wave_file(pcm, channels, rate, sample_width)
 
         dtype = {1: np.int8, 2: np.int16, 4: np.int32}[sample_width]
         samples = np.frombuffer(pcm, dtype=dtype)
 
-        chunk_size = max(1, len(samples) // 80)
-
-        waveform = bytes(
-            [
-                int(
-                    min(
-                        255,
-                        np.abs(samples[i : i + chunk_size]).mean()
-                        / (2 ** (8 * sample_width - 1))
-                        * 255,
-                    )
-                )
-                for i in range(0, len(samples), chunk_size)
-            ]
-        )
-
-        waveform = waveform[:80]
-        file.name = "audio.ogg"
-        file.waveform = waveform
-        file.duration = round(duration)
+        file.waveform = Response.get_waveform(samples, sample_width)
+        file.duration = round(len(samples) / channels / rate)
 
         return file
 
@@ -141,7 +164,17 @@ class Response:
             return "audio" in self._inline_data.mime_type
         return False
 
-    @property
-    def audio_file(self) -> io.BytesIO | None:
+    async def get_audio_file(self) -> io.BytesIO | None:
         inline_data = self._inline_data
-        return self.save_wave_file(inline_data.data) if inline_data else None
+
+        if not inline_data:
+            return None
+
+        if self._audio_file is None:
+            # mime_type looks like: audio/L16;codec=pcm;rate=24000
+            rate = re.search(r"rate=(\d+)", inline_data.mime_type or "")
+            self._audio_file = await self.save_voice_file(
+                inline_data.data, rate=int(rate.group(1)) if rate else 24000
+            )
+
+        return self._audio_file
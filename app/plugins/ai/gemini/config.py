@@ -1,4 +1,5 @@
 import logging
+from types import MappingProxyType
 
 from google.genai import types
 from ub_core import CustomDB
@@ -102,33 +103,67 @@ class AIConfig:
         speech_config=FEMALE_SPEECH_CONFIG,
     )
 
+    # Context Caching for long conversations
+    CACHE_MIN_TOKENS = 4096
+    CACHE_TTL = 600
+    CACHE_REFRESH_MARGIN = 60
+
+    # Parallel requests allowed per model
+    MAX_CONCURRENT_REQUESTS = 3
+
+    # Refresh interval of the cached model list
+    MODEL_CATALOG_TTL = 6 * 3600
+
+    # Opt-in cache for identical .ai queries
+    RESPONSE_CACHE_SIZE = 128
+    RESPONSE_CACHE_TTL = 3600
+
+    # Flag combination key -> (model attribute, config)
+    # Built once and shared between requests, never mutate these configs.
+    CONFIG_TABLE: MappingProxyType[str, tuple[str, types.GenerateContentConfig]]
+
     @staticmethod
-    def get_kwargs(flags: list[str]) -> dict:
+    def get_config_key(flags: list[str]) -> str:
         if "-i" in flags:
-            return {"model": AIConfig.IMAGE_MODEL, "config": AIConfig.IMAGE_CONFIG}
+            return "image"
 
         if "-a" in flags:
-            audio_config = AIConfig.AUDIO_CONFIG
-
-            if "-m" in flags:
-                audio_config.speech_config = MALE_SPEECH_CONFIG
-            else:
-                audio_config.speech_config = FEMALE_SPEECH_CONFIG
-
-            return {"model": AIConfig.AUDIO_MODEL, "config": audio_config}
+            return "audio_male" if "-m" in flags else "audio_female"
 
         if "-sp" in flags:
-            AIConfig.AUDIO_CONFIG.speech_config = MULTI_SPEECH_CONFIG
-            return {"model": AIConfig.AUDIO_MODEL, "config": AIConfig.AUDIO_CONFIG}
+            return "audio_multi_speaker"
 
-        tools = AIConfig.TEXT_CONFIG.tools
+        return "text_search" if "-s" in flags else "text"
 
-        use_search = "-s" in flags
-
-        if not use_search and SEARCH_TOOL in tools:
-            tools.remove(SEARCH_TOOL)
+    @staticmethod
+    def get_kwargs(flags: list[str]) -> dict:
+        model_attr, config = AIConfig.CONFIG_TABLE[AIConfig.get_config_key(flags)]
+        return {"model": getattr(AIConfig, model_attr), "config": config}
+
+
+def build_config_table() -> MappingProxyType:
+    def copy(config: types.GenerateContentConfig, **update) -> types.GenerateContentConfig:
+        return config.model_copy(update=update, deep=True)
+
+    return MappingProxyType(
+        {
+            "text": ("TEXT_MODEL", copy(AIConfig.TEXT_CONFIG, tools=[])),
+            "text_search": ("TEXT_MODEL", copy(AIConfig.TEXT_CONFIG, tools=[SEARCH_TOOL])),
+            "image": ("IMAGE_MODEL", copy(AIConfig.IMAGE_CONFIG)),
+            "audio_male": (
+                "AUDIO_MODEL",
+                copy(AIConfig.AUDIO_CONFIG, speech_config=MALE_SPEECH_CONFIG),
+            ),
+            "audio_female": (
+                "AUDIO_MODEL",
+                copy(AIConfig.AUDIO_CONFIG, speech_config=FEMALE_SPEECH_CONFIG),
+            ),
+            "audio_multi_speaker": (
+                "AUDIO_MODEL",
+                copy(AIConfig.AUDIO_CONFIG, speech_config=MULTI_SPEECH_CONFIG),
+            ),
+        }
+    )
 
-        if use_search and SEARCH_TOOL not in tools:
-            tools.append(SEARCH_TOOL)
 
-        return {"model": AIConfig.TEXT_MODEL, "config": AIConfig.TEXT_CONFIG}
+AIConfig.CONFIG_TABLE = build_config_table()
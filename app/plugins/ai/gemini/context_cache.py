@@ -0,0 +1,145 @@
+from datetime import UTC, datetime
+
+from google.genai import types
+from google.genai.errors import APIError
+
+from app import LOGGER
+from app.plugins.ai.gemini import AIConfig, async_client
+from app.plugins.ai.gemini.scheduler import SCHEDULER
+from app.plugins.ai.stats import register_stats
+
+
+class CacheStats:
+    caches_created = 0
+    caches_refreshed = 0
+    prompt_tokens = 0
+    cached_tokens = 0
+
+
+@register_stats("Gemini Context Cache")
+def context_cache_stats() -> dict[str, str | int]:
+    if not CacheStats.prompt_tokens:
+        return {}
+
+    saved_ratio = CacheStats.cached_tokens / CacheStats.prompt_tokens * 100
+
+    return {
+        "Caches created": CacheStats.caches_created,
+        "Caches refreshed": CacheStats.caches_refreshed,
+        "Prompt tokens": CacheStats.prompt_tokens,
+        "Served from cache": f"{CacheStats.cached_tokens} ({saved_ratio:.1f}%)",
+    }
+
+
+class CachedChat:
+    """
+    AsyncChat wrapper that moves the system prompt and older turns
+    into a Gemini cached content once the un-cached part of the prompt
+    grows past AIConfig.CACHE_MIN_TOKENS.
+    """
+
+    def __init__(
+        self, model: str, config: types.GenerateContentConfig, history: list | None = None
+    ):
+        self.model = model
+        self.config = config
+        # Image and Audio models don't support cached contents.
+        self.cacheable = model == AIConfig.TEXT_MODEL
+
+        self.cache: types.CachedContent | None = None
+        self.cached_history: list[types.Content] = []
+
+        self.chat = async_client.chats.create(model=model, config=config, history=history or [])
+
+    @property
+    def history(self) -> list[types.Content]:
+        return self.cached_history + self.chat.get_history(curated=True)
+
+    async def send_message(self, prompt) -> types.GenerateContentResponse:
+        await self.refresh_cache()
+
+        response = await SCHEDULER.run(self.model, self.chat.send_message, prompt)
+
+        usage = response.usage_metadata
+        if not usage:
+            return response
+
+        prompt_tokens = usage.prompt_token_count or 0
+        cached_tokens = usage.cached_content_token_count or 0
+
+        CacheStats.prompt_tokens += prompt_tokens
+        CacheStats.cached_tokens += cached_tokens
+
+        if self.cacheable and prompt_tokens - cached_tokens >= AIConfig.CACHE_MIN_TOKENS:
+            await self.create_cache()
+
+        return response
+
+    async def create_cache(self):
+        history = self.history
+
+        try:
+            cache = await async_client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    contents=history,
+                    system_instruction=self.config.system_instruction,
+                    tools=self.config.tools or None,
+                    ttl=f"{AIConfig.CACHE_TTL}s",
+                ),
+            )
+        except APIError as e:
+            LOGGER.error(f"Gemini context caching disabled for chat: {e}")
+            self.cacheable = False
+            if self.cache is None and self.cached_history:
+                # Old cache is gone, fall back to sending full history.
+                self.cached_history = []
+                self.chat = async_client.chats.create(
+                    model=self.model, config=self.config, history=history
+                )
+            return
+
+        await self.delete_cache()
+
+        CacheStats.caches_created += 1
+
+        self.cache = cache
+        self.cached_history = history
+        self.chat = async_client.chats.create(
+            model=self.model,
+            config=self.config.model_copy(
+                update={"cached_content": cache.name, "system_instruction": None, "tools": None}
+            ),
+            history=[],
+        )
+
+    async def refresh_cache(self):
+        if not (self.cache and self.cache.expire_time):
+            return
+
+        time_left = (self.cache.expire_time - datetime.now(UTC)).total_seconds()
+
+        if time_left > AIConfig.CACHE_REFRESH_MARGIN:
+            return
+
+        try:
+            self.cache = await async_client.caches.update(
+                name=self.cache.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{AIConfig.CACHE_TTL}s"),
+            )
+            CacheStats.caches_refreshed += 1
+        except APIError:
+            # Expired before it could be extended, rebuild it from local history.
+            self.cache = None
+            await self.create_cache()
+
+    async def delete_cache(self):
+        if not self.cache:
+            return
+
+        try:
+            await async_client.caches.delete(name=self.cache.name)
+        except APIError:
+            pass
+
+        self.cache = None
@@ -3,7 +3,10 @@ from pyrogram.types import InputMediaAudio, InputMediaPhoto
 
 from app import BOT, Message, bot
 from app.plugins.ai.gemini import AIConfig, Response, async_client
-from app.plugins.ai.gemini.utils import create_prompts, run_basic_check
+from app.plugins.ai.gemini.response_cache import RESPONSE_CACHE, get_cache_key
+from app.plugins.ai.gemini.scheduler import SCHEDULER
+from app.plugins.ai.gemini.utils import create_prompts, get_batch_count, run_basic_check
+from app.plugins.ai.providers import ROUTER
 
 
 @bot.add_cmd(cmd="ai")
@@ -19,6 +22,8 @@ async def question(bot: BOT, message: Message):
             -m: male voice
             -f: female voice
         -sp: to create speech between two people
+        -n: to use multiple messages as input
+        -nocache: skip the response cache [if enabled with .aicache]
 
     USAGE:
         .ai what is the meaning of life.
@@ -28,6 +33,10 @@ async def question(bot: BOT, message: Message):
         .ai [reply to image | video | gif]
         .ai [reply to image | video | gif] [custom prompt]
 
+        .ai -n 20 [custom prompt] (uses last 20 messages)
+        .ai -n 20 [reply to a message] [custom prompt] (uses replied + next 19 messages)
+        .ai [reply to an album] [custom prompt] (uses every item in the album)
+
         .ai -a [-m|-f] <text to speak> (defaults to female voice)
 
         .ai -sp TTS the following conversation between Joe and Jane:
@@ -38,24 +47,39 @@ async def question(bot: BOT, message: Message):
     reply = message.replied
     prompt = message.filtered_input.strip()
 
-    if reply and reply.media:
+    if (reply and reply.media) or "-n" in message.flags:
         resp_str = "<code>Processing... this may take a while.</code>"
     else:
         resp_str = "<code>Input received... generating response.</code>"
 
     message_response = await message.reply(resp_str)
 
+    kwargs = AIConfig.get_kwargs(flags=message.flags)
+    config_key = AIConfig.get_config_key(message.flags)
+
+    cache_key = get_cache_key(message=message, model=kwargs["model"], config_key=config_key)
+
+    ai_response = RESPONSE_CACHE.get(cache_key)
+
     try:
-        prompts = await create_prompts(message=message)
+        _, prompt = get_batch_count(message)
+        if ai_response is None:
+            prompts = await create_prompts(message=message)
     except AssertionError as e:
         await message_response.edit(e)
         return
 
-    kwargs = AIConfig.get_kwargs(flags=message.flags)
-
-    response = await async_client.models.generate_content(contents=prompts, **kwargs)
+    if ai_response is None:
+        if ROUTER.can_route(config_key, prompts):
+            # Plain text queries go to the fastest healthy provider.
+            ai_response = await ROUTER.generate(prompts)
+        else:
+            ai_response = await SCHEDULER.run(
+                kwargs["model"], async_client.models.generate_content, contents=prompts, **kwargs
+            )
+        RESPONSE_CACHE.set(cache_key, ai_response)
 
-    response = Response(response)
+    response = Response(ai_response)
 
     text = response.text_with_sources()
 
@@ -66,19 +90,20 @@ async def question(bot: BOT, message: Message):
         return
 
     if response.audio:
+        audio_file = await response.get_audio_file()
         if isinstance(message, Message):
             await message.reply_voice(
-                voice=response.audio_file,
-                waveform=response.audio_file.waveform,
-                duration=response.audio_file.duration,
+                voice=audio_file,
+                waveform=audio_file.waveform,
+                duration=audio_file.duration,
                 caption=f"**>\n•> {prompt}<**",
             )
         else:
             await message_response.edit_media(
                 media=InputMediaAudio(
-                    media=response.audio_file,
+                    media=audio_file,
                     caption=f"**>\n•> {prompt}<**",
-                    duration=response.audio_file.duration,
+                    duration=audio_file.duration,
                 )
             )
         return
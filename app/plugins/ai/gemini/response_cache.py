@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+from google.genai.types import GenerateContentResponse
+from ub_core.utils import get_tg_media_details
+
+from app import BOT, Message, bot
+from app.plugins.ai.gemini import DB_SETTINGS, AIConfig
+from app.plugins.ai.stats import register_stats
+
+
+async def init_task():
+    cache_switch = await DB_SETTINGS.find_one({"_id": "gemini_response_cache"}) or {}
+    RESPONSE_CACHE.enabled = cache_switch.get("value", False)
+
+
+class ResponseCache:
+    """Size bounded LRU of model responses with per-entry expiry."""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[float, GenerateContentResponse]] = OrderedDict()
+
+    def get(self, key: str | None) -> GenerateContentResponse | None:
+        if key is None:
+            return None
+
+        cached = self._data.get(key)
+
+        if cached is None or cached[0] < time.time():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return cached[1]
+
+    def set(self, key: str | None, response: GenerateContentResponse):
+        # Don't cache failed or blocked queries.
+        if key is None or not response.candidates:
+            return
+
+        self._data[key] = (time.time() + self.ttl, response)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+RESPONSE_CACHE = ResponseCache(
+    max_size=AIConfig.RESPONSE_CACHE_SIZE, ttl=AIConfig.RESPONSE_CACHE_TTL
+)
+
+
+def normalize(text: str | None) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def get_cache_key(message: Message, model: str, config_key: str) -> str | None:
+    """
+    Key made from model, config, normalized prompt and
+    file_unique_id (Telegram's content hash) of replied media.
+
+    Returns None for requests that shouldn't be cached.
+    """
+    reply = message.replied
+
+    if (
+        not RESPONSE_CACHE.enabled
+        or "-nocache" in message.flags
+        # Batch inputs change with every new message in chat.
+        or "-n" in message.flags
+        or (reply and reply.media_group_id)
+        # New images are expected on every run.
+        or config_key == "image"
+    ):
+        return None
+
+    key_parts = [model, config_key, normalize(message.filtered_input)]
+
+    if reply:
+        key_parts.append(normalize(reply.text))
+        if reply.media:
+            media = get_tg_media_details(reply)
+            key_parts.append(getattr(media, "file_unique_id", None) or str(reply.id))
+
+    return hashlib.sha256("\0".join(key_parts).encode()).hexdigest()
+
+
+@register_stats("Gemini Response Cache")
+def response_cache_stats() -> dict[str, str | int]:
+    lookups = RESPONSE_CACHE.hits + RESPONSE_CACHE.misses
+
+    if not (RESPONSE_CACHE.enabled or lookups):
+        return {}
+
+    hit_ratio = RESPONSE_CACHE.hits / lookups * 100 if lookups else 0
+
+    return {
+        "Enabled": RESPONSE_CACHE.enabled,
+        "Entries": len(RESPONSE_CACHE._data),
+        "Hits": RESPONSE_CACHE.hits,
+        "Misses": RESPONSE_CACHE.misses,
+        "Hit ratio": f"{hit_ratio:.1f}%",
+    }
+
+
+@bot.add_cmd(cmd="aicache")
+async def response_cache_switch(bot: BOT, message: Message):
+    """
+    CMD: AICACHE
+    INFO: Enable/Disable caching of identical .ai queries.
+    FLAGS:
+        -c: to check status.
+        -clear: to empty the cache.
+    USAGE:
+        .aicache | .aicache -c | .aicache -clear
+        .ai -nocache [query] (to skip the cache for a query)
+    """
+    if "-c" in message.flags:
+        await message.reply(
+            text=f"AI Response Cache is enabled: <b>{RESPONSE_CACHE.enabled}</b>", del_in=8
+        )
+        return
+
+    if "-clear" in message.flags:
+        RESPONSE_CACHE.clear()
+        await message.reply(text="AI Response Cache cleared.", del_in=8)
+        return
+
+    value = not RESPONSE_CACHE.enabled
+    RESPONSE_CACHE.enabled = value
+
+    if not value:
+        RESPONSE_CACHE.clear()
+
+    await asyncio.gather(
+        DB_SETTINGS.add_data({"_id": "gemini_response_cache", "value": value}),
+        message.reply(text=f"AI Response Cache is enabled: <b>{value}</b>!", del_in=8),
+    )
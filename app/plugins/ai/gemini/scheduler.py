@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import defaultdict
+from enum import IntEnum
+
+from google.genai.errors import APIError
+
+from app import extra_config
+from app.plugins.ai.gemini import AIConfig
+from app.plugins.ai.stats import register_stats
+
+
+class Priority(IntEnum):
+    TEXT = 0
+    MEDIA = 1
+
+
+class TokenBucket:
+    """
+    Refills at a constant rate and allows short bursts up to capacity.
+    Waiting requests get tokens lowest priority value first, FIFO within a priority.
+    """
+
+    def __init__(self, requests_per_minute: int, capacity: int):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._wakeup: asyncio.TimerHandle | None = None
+
+    @property
+    def queued(self) -> int:
+        return sum(not future.done() for *_, future in self._waiters)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, priority: int = Priority.TEXT):
+        self._refill()
+
+        if self.tokens >= 1 and not self.queued:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Token was handed over right before cancellation, give it back.
+            if future.done() and not future.cancelled():
+                self.tokens += 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        self._refill()
+
+        while self._waiters and self.tokens >= 1:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+        self._schedule()
+
+    def _schedule(self):
+        """Wake up once the next token is due, if anyone is still waiting."""
+        if self._wakeup is None and self.queued:
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def drain(self):
+        """Called on 429s to slow down every queued request, not just the failed one."""
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class PriorityLimiter:
+    """Semaphore that hands free slots to the lowest priority value first."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(not future.done() for *_, future in self._waiters)
+
+    async def acquire(self, priority: int):
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Slot was handed over right before cancellation, pass it on.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class AIScheduler:
+    RETRY_CODES = {429, 500, 503}
+    MAX_RETRIES = 4
+    BASE_DELAY = 2
+    MAX_DELAY = 60
+
+    def __init__(self, requests_per_minute: int, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self.bucket = TokenBucket(
+            requests_per_minute=requests_per_minute,
+            capacity=max(1, min(max_concurrent, requests_per_minute)),
+        )
+        self.limiters: dict[str, PriorityLimiter] = defaultdict(
+            lambda: PriorityLimiter(self.max_concurrent)
+        )
+        self.completed = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def run(self, model: str, func, *args, priority: Priority | None = None, **kwargs):
+        """
+        :param model: Model name, requests are limited per model.
+        :param func: Coroutine function that makes the API call.
+        :param priority: Priority lane, defaults to TEXT for the text model and MEDIA otherwise.
+            Applies to the per-model slots and to the rate limit shared by all models.
+        :return: Result of func.
+        """
+        if priority is None:
+            priority = Priority.TEXT if model == AIConfig.TEXT_MODEL else Priority.MEDIA
+
+        limiter = self.limiters[model]
+        await limiter.acquire(priority)
+
+        try:
+            for attempt in itertools.count():
+                await self.bucket.acquire(priority)
+                try:
+                    result = await func(*args, **kwargs)
+                    self.completed += 1
+                    return result
+                except APIError as e:
+                    if e.code not in self.RETRY_CODES or attempt >= self.MAX_RETRIES:
+                        self.failed += 1
+                        raise
+
+                    if e.code == 429:
+                        self.bucket.drain()
+
+                    self.retries += 1
+                    await asyncio.sleep(self.get_backoff(error=e, attempt=attempt))
+        finally:
+            limiter.release()
+
+    def get_backoff(self, error: APIError, attempt: int) -> float:
+        # Full jitter, but never retry earlier than the server asked us to.
+        delay = random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2**attempt))
+        return max(delay, get_retry_delay(error))
+
+
+def get_retry_delay(error: APIError) -> float:
+    try:
+        details = error.details["error"]["details"]
+    except (KeyError, TypeError):
+        return 0
+
+    for detail in details:
+        if isinstance(detail, dict) and detail.get("@type", "").endswith("RetryInfo"):
+            try:
+                return float(detail["retryDelay"].rstrip("s"))
+            except (KeyError, ValueError):
+                return 0
+    return 0
+
+
+SCHEDULER = AIScheduler(
+    requests_per_minute=extra_config.GEMINI_RPM, max_concurrent=AIConfig.MAX_CONCURRENT_REQUESTS
+)
+
+
+@register_stats("Gemini Scheduler")
+def scheduler_stats() -> dict[str, int]:
+    return {
+        "Completed": SCHEDULER.completed,
+        "Retried": SCHEDULER.retries,
+        "Failed": SCHEDULER.failed,
+        "Running": sum(limiter.active for limiter in SCHEDULER.limiters.values()),
+        "Queued": sum(limiter.queued for limiter in SCHEDULER.limiters.values())
+        + SCHEDULER.bucket.queued,
+    }
@@ -5,10 +5,12 @@ from functools import wraps
 from mimetypes import guess_type
 
 from google.genai.types import File, Part
-from ub_core.utils import get_tg_media_details
+from ub_core.utils import get_name, get_tg_media_details
 
 from app import BOT, Message, extra_config
 from app.plugins.ai.gemini import DB_SETTINGS, AIConfig, async_client
+from app.plugins.ai.gemini.catalog import ModelCatalog
+from app.plugins.tg_tools.get_message import get_message_batch
 
 
 def run_basic_check(function):
@@ -36,7 +38,7 @@ async def save_file(message: Message, check_size: bool = True) -> File | None:
     if check_size:
         assert getattr(media, "file_size", 0) <= 1048576 * 25, "File size exceeds 25mb."
 
-    download_dir = f"downloads/{time.time()}/"
+    download_dir = f"downloads/{time.time()}_{message.id}/"
     try:
         downloaded_file: str = await message.download(download_dir)
         uploaded_file = await async_client.files.upload(
@@ -67,6 +69,76 @@ PROMPT_MAP = {
 }
 PROMPT_MAP["audio"] = PROMPT_MAP["voice"]
 
+MAX_BATCH_SIZE = 50
+
+# Media of a batch downloaded and uploaded at the same time.
+BATCH_UPLOAD_SEMAPHORE = asyncio.Semaphore(4)
+
+
+def get_batch_count(message: Message) -> tuple[int, str]:
+    """Returns the -n message count and the prompt left after removing it."""
+    prompt = message.filtered_input.strip()
+
+    if "-n" not in message.flags:
+        return 0, prompt
+
+    count, _, prompt = prompt.partition(" ")
+
+    if not count.isdigit():
+        raise AssertionError("Give a message count with -n: .ai -n 10 [prompt]")
+
+    return min(int(count), MAX_BATCH_SIZE), prompt.strip()
+
+
+async def get_batch_messages(message: Message) -> list[Message]:
+    """-n <count> messages or the replied album, see get_message_batch."""
+    count, _ = get_batch_count(message)
+    messages = await get_message_batch(message=message, count=count)
+    return [msg for msg in messages if msg.text or msg.media]
+
+
+async def create_batch_prompts(
+    messages: list[Message], prompt: str, check_size: bool = True
+) -> list[Part]:
+    media_messages = [msg for msg in messages if msg.media]
+
+    async def save_batch_file(msg: Message) -> File:
+        async with BATCH_UPLOAD_SEMAPHORE:
+            return await save_file(message=msg, check_size=check_size)
+
+    tasks = [asyncio.create_task(save_batch_file(msg)) for msg in media_messages]
+
+    try:
+        uploaded_files = await asyncio.gather(*tasks)
+    except BaseException:
+        # One failed, the prompt is unusable: stop the rest and drop finished uploads.
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        uploaded_files = [file for file in results if isinstance(file, File)]
+        await asyncio.gather(
+            *[async_client.files.delete(name=file.name) for file in uploaded_files],
+            return_exceptions=True,
+        )
+        raise
+
+    file_parts = {
+        msg.id: Part.from_uri(file_uri=file.uri, mime_type=file.mime_type)
+        for msg, file in zip(media_messages, uploaded_files)
+    }
+
+    prompts = [Part.from_text(text=prompt or "Summarize these messages.")]
+
+    for msg in messages:
+        sender = msg.from_user or msg.sender_chat
+        if text := (msg.text or msg.caption):
+            name = get_name(sender) if sender else "Unknown"
+            prompts.append(Part.from_text(text=f"{name}: {text}"))
+        if msg.id in file_parts:
+            prompts.append(file_parts[msg.id])
+
+    return prompts
+
 
 async def create_prompts(
     message: Message, is_chat: bool = False, check_size: bool = True
@@ -87,6 +159,10 @@ async def create_prompts(
         return [Part.from_text(text=message.text)]
 
     # Single Use
+    if batch := await get_batch_messages(message):
+        _, prompt = get_batch_count(message)
+        return await create_batch_prompts(messages=batch, prompt=prompt, check_size=check_size)
+
     if reply := message.replied:
         if reply.media:
             prompt = (
@@ -107,13 +183,15 @@ async def list_ai_models(bot: BOT, message: Message):
     """
     CMD: LIST MODELS
     INFO: List and change Gemini Models.
-    USAGE: .llms
+    FLAGS:
+        -i: change image model
+        -r: refresh the cached model list
+    USAGE: .llms | .llms -i | .llms -r
     """
-    model_list = [
-        model.name.lstrip("models/")
-        async for model in await async_client.models.list(config={"query_base": True})
-        if "generateContent" in model.supported_actions
-    ]
+    if "-r" in message.flags:
+        await ModelCatalog.refresh()
+
+    model_list = await ModelCatalog.get_models()
 
     model_str = "\n\n".join(model_list)
 
@@ -134,18 +212,20 @@ async def list_ai_models(bot: BOT, message: Message):
         await model_info_response.delete()
         return
 
-    if model_response.text not in model_list:
+    model_name = model_response.text.strip().removeprefix("models/")
+
+    if model_name not in model_list:
         await model_info_response.edit(f"<code>Invalid Model... Try again</code>")
         return
 
     if "-i" in message.flags:
         data_key = "image_model_name"
-        AIConfig.IMAGE_MODEL = model_response.text
+        AIConfig.IMAGE_MODEL = model_name
     else:
         data_key = "model_name"
-        AIConfig.TEXT_MODEL = model_response.text
+        AIConfig.TEXT_MODEL = model_name
 
-    await DB_SETTINGS.add_data({"_id": "gemini_model_info", data_key: model_response.text})
-    resp_str = f"{model_response.text} saved as model."
+    await DB_SETTINGS.add_data({"_id": "gemini_model_info", data_key: model_name})
+    resp_str = f"{model_name} saved as model."
     await model_info_response.edit(resp_str)
     await bot.log_text(text=resp_str, type=f"ai_{data_key}")
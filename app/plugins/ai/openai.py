@@ -1,17 +1,32 @@
-﻿from base64 import b64decode
+﻿import asyncio
+import time
+from base64 import b64decode
 from io import BytesIO
 from os import environ
 
+import httpx
 import openai
+from google.genai.types import Part
 from pyrogram.enums import ParseMode
-from pyrogram.types import InputMediaPhoto
+from pyrogram.types import InputMediaPhoto, ReplyParameters
 
 from app import BOT, Message
+from app.plugins.ai.gemini import Response
 from app.plugins.ai.gemini.config import SYSTEM_INSTRUCTION
+from app.plugins.ai.providers import FAILOVER_ERRORS, ROUTER, OpenAIProvider
+from app.plugins.ai.stats import LatencyTracker, register_stats
 
 OPENAI_CLIENT = environ.get("OPENAI_CLIENT", "")
 OPENAI_MODEL = environ.get("OPENAI_MODEL", "gpt-4o")
 
+# Min seconds between edits of a streamed response, keeps us clear of edit flood waits.
+STREAM_EDIT_INTERVAL = 2
+
+# Parallel image generation requests allowed for .igen -n
+IMAGE_GEN_SEMAPHORE = asyncio.Semaphore(int(environ.get("DALL_E_CONCURRENCY", 4)))
+
+MAX_IMAGES = 10
+
 AI_CLIENT = getattr(openai, f"Async{OPENAI_CLIENT}OpenAI")
 
 if AI_CLIENT == openai.AsyncAzureOpenAI:
@@ -35,16 +50,40 @@ else:
         api_key=environ.get("DALL_E_API_KEY"), base_url=environ.get("DALL_E_ENDPOINT")
     )
 
+
+def get_http_client() -> httpx.AsyncClient:
+    # Explicit pool so connections to the API stay warm between commands.
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300),
+        timeout=httpx.Timeout(120, connect=10),
+    )
+
+
 try:
-    TEXT_CLIENT = AI_CLIENT(**text_init_kwargs)
+    TEXT_CLIENT = AI_CLIENT(**text_init_kwargs, http_client=get_http_client())
 except:
     TEXT_CLIENT = None
 
 try:
-    DALL_E_CLIENT = AI_CLIENT(**image_init_kwargs)
+    DALL_E_CLIENT = AI_CLIENT(**image_init_kwargs, http_client=get_http_client())
 except:
     DALL_E_CLIENT = None
 
+OPENAI_PROVIDER = OpenAIProvider(client=TEXT_CLIENT, model=OPENAI_MODEL)
+ROUTER.register(OPENAI_PROVIDER)
+
+FIRST_TOKEN_LATENCY = LatencyTracker()
+TOTAL_LATENCY = LatencyTracker()
+
+
+@register_stats("OpenAI")
+def openai_stats() -> dict[str, str]:
+    stats = {}
+    for model in TOTAL_LATENCY.samples:
+        stats[f"{model} first token"] = FIRST_TOKEN_LATENCY.summary(model)
+        stats[f"{model} total"] = TOTAL_LATENCY.summary(model)
+    return stats
+
 
 @BOT.add_cmd(cmd="gpt")
 async def chat_gpt(bot: BOT, message: Message):
@@ -68,6 +107,8 @@ async def chat_gpt(bot: BOT, message: Message):
                 AZURE_OPENAI_ENDPOINT = your azure endpoint
                 AZURE_DEPLOYMENT = your azure deployment
 
+    If OpenAI is down or erroring, the query fails over to Gemini [if set up].
+
     USAGE:
         .gpt hi
         .gpt [reply to a message]
@@ -84,17 +125,90 @@ async def chat_gpt(bot: BOT, message: Message):
         await message.reply("Ask a Question | Reply to a message.")
         return
 
-    chat_completion = await TEXT_CLIENT.chat.completions.create(
-        messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTION},
-            {"role": "user", "content": prompt},
-        ],
-        model=OPENAI_MODEL,
-    )
+    # Long prompts would push the placeholder past Telegram's 4096 char limit.
+    response = await message.reply(f"••> {prompt[:4000]}", parse_mode=ParseMode.DISABLED)
+
+    text = None
+    exclude = set()
+
+    if OPENAI_PROVIDER.healthy:
+        try:
+            text = await stream_completion(
+                messages=[
+                    {"role": "system", "content": SYSTEM_INSTRUCTION},
+                    {"role": "user", "content": prompt},
+                ],
+                response=response,
+                prefix=f"••> {prompt}\n\n",
+            )
+        except FAILOVER_ERRORS:
+            exclude.add(OPENAI_PROVIDER.name)
+
+    if text is None:
+        ai_response = await ROUTER.generate([Part.from_text(text=prompt)], exclude=exclude)
+        # Blocked or empty answers have no text, show the failure string instead.
+        text = Response(ai_response).text(quote_mode=None)
+
+    await send_final_text(message=message, response=response, text=f"**>\n••> {prompt}<**\n" + text)
+
+
+async def stream_completion(messages: list[dict], response: Message, prefix: str = "") -> str:
+    """
+    Streams a completion into the response message, editing at most once every STREAM_EDIT_INTERVAL.
+    Partial chunks are sent without formatting, caller does the final formatted edit.
+    """
+    start = time.perf_counter()
+    last_edit = start
+    # Time spent editing on Telegram, excluded from the provider's latency.
+    edit_time = 0.0
+    text = ""
+    # The placeholder already shows the prefix.
+    last_edit_text = prefix.strip()
+
+    try:
+        stream = await TEXT_CLIENT.chat.completions.create(
+            messages=messages, model=OPENAI_MODEL, stream=True
+        )
+
+        async for chunk in stream:
+            if not (chunk.choices and chunk.choices[0].delta.content):
+                continue
+
+            if not text:
+                FIRST_TOKEN_LATENCY.add(OPENAI_MODEL, time.perf_counter() - start)
+
+            text += chunk.choices[0].delta.content
+
+            partial_text = prefix + text
+
+            if (
+                len(partial_text) < 4096
+                and time.perf_counter() - last_edit >= STREAM_EDIT_INTERVAL
+                # Telegram strips whitespace, an edit that only adds some is MESSAGE_NOT_MODIFIED.
+                and partial_text.strip() != last_edit_text
+            ):
+                last_edit_text = partial_text.strip()
+                last_edit = time.perf_counter()
+                await response.edit(text=partial_text, parse_mode=ParseMode.DISABLED)
+                edit_time += time.perf_counter() - last_edit
 
-    response = chat_completion.choices[0].message.content
+    except FAILOVER_ERRORS:
+        OPENAI_PROVIDER.record(success=False)
+        raise
+
+    total_latency = time.perf_counter() - start - edit_time
+    TOTAL_LATENCY.add(OPENAI_MODEL, total_latency)
+    OPENAI_PROVIDER.record(success=True, latency=total_latency)
+    return text
 
-    await message.reply(text=f"**>\n••> {prompt}<**\n" + response, parse_mode=ParseMode.MARKDOWN)
+
+async def send_final_text(message: Message, response: Message, text: str):
+    if len(text) < 4096:
+        await response.edit(text=text, parse_mode=ParseMode.MARKDOWN)
+        return
+    # Too long to edit into, let reply handle it.
+    await response.delete()
+    await message.reply(text=text, parse_mode=ParseMode.MARKDOWN)
 
 
 @BOT.add_cmd(cmd="igen")
@@ -117,27 +231,41 @@ async def chat_gpt(bot: BOT, message: Message):
                 DALL_E_ENDPOINT = your azure endpoint
                 DALL_E_DEPLOYMENT = your azure deployment
 
+            Optional:
+                DALL_E_CONCURRENCY = parallel requests for -n (default 4)
+
     FLAGS:
         -v: for vivid style images (default)
-        -n: for less vivid and natural type of images
+        -nat: for less vivid and natural type of images
+        -n: number of images to generate [max 10]
         -s: to send with spoiler
         -p: portrait output
         -l: landscape output
 
     USAGE:
         .igen cats on moon
+        .igen -n 4 cats on moon
     """
     if DALL_E_CLIENT is None:
         await message.reply(f"OpenAI Creds not set or are invalid.\nCheck Help.")
         return
 
     prompt = message.filtered_input.strip()
+    count = 1
+
+    if "-n" in message.flags:
+        count_str, _, prompt = prompt.partition(" ")
+        if not count_str.isdigit():
+            await message.reply("Give number of images with -n: .igen -n 4 cats on moon")
+            return
+        count = max(1, min(int(count_str), MAX_IMAGES))
+        prompt = prompt.strip()
 
     if not prompt:
         await message.reply("Give a prompt to generate image.")
         return
 
-    response = await message.reply("Generating image...")
+    response = await message.reply(f"Generating {count} image{'s' if count > 1 else ''}...")
 
     if "-p" in message.flags:
         output_res = "1024x1792"
@@ -146,25 +274,68 @@ async def chat_gpt(bot: BOT, message: Message):
     else:
         output_res = "1024x1024"
 
-    try:
+    # dall-e-3 only supports n=1, so fan out separate requests.
+    results = await asyncio.gather(
+        *[
+            generate_image(
+                prompt=prompt,
+                size=output_res,
+                style="natural" if "-nat" in message.flags else "vivid",
+            )
+            for _ in range(count)
+        ],
+        return_exceptions=True,
+    )
+
+    images = [result for result in results if isinstance(result, BytesIO)]
+
+    if not images:
+        await response.edit("Something went wrong... Check log channel.")
+        raise results[0]
+
+    caption = f"**>\n{prompt}\n<**"
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+
+    for error in errors:
+        bot.log.error(f"Dall-E generation failed: {error}", exc_info=error)
+
+    if errors:
+        caption += f"\n{len(errors)} of {count} images failed to generate."
+
+    has_spoiler = "-s" in message.flags
+
+    if len(images) == 1:
+        await response.edit_media(
+            InputMediaPhoto(media=images[0], caption=caption, has_spoiler=has_spoiler)
+        )
+        return
+
+    await bot.send_media_group(
+        chat_id=message.chat.id,
+        media=[
+            InputMediaPhoto(
+                media=image, caption=caption if idx == 0 else "", has_spoiler=has_spoiler
+            )
+            for idx, image in enumerate(images)
+        ],
+        reply_parameters=ReplyParameters(message_id=message.id),
+    )
+    await response.delete()
+
+
+async def generate_image(prompt: str, size: str, style: str) -> BytesIO:
+    async with IMAGE_GEN_SEMAPHORE:
         generated_image = await DALL_E_CLIENT.images.generate(
             model="dall-e-3",
             prompt=prompt,
             n=1,
-            size=output_res,
+            size=size,
             quality="hd",
             response_format="b64_json",
-            style="natural" if "-n" in message.flags else "vivid",
+            style=style,
         )
-    except Exception:
-        await response.edit("Something went wrong... Check log channel.")
-        raise
 
-    image_io = BytesIO(b64decode(generated_image.data[0].b64_json))
+    image_io = BytesIO(await asyncio.to_thread(b64decode, generated_image.data[0].b64_json))
     image_io.name = "photo.png"
-
-    await response.edit_media(
-        InputMediaPhoto(
-            media=image_io, caption=f"**>\n{prompt}\n<**", has_spoiler="-s" in message.flags
-        )
-    )
+    return image_io
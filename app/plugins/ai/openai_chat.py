@@ -0,0 +1,182 @@
+import asyncio
+from collections import OrderedDict
+from os import environ
+
+from pyrogram.enums import ChatType, ParseMode
+
+from app import BOT, Convo, Message, bot
+from app.plugins.ai.gemini.config import SYSTEM_INSTRUCTION
+from app.plugins.ai.openai import OPENAI_MODEL, TEXT_CLIENT, send_final_text, stream_completion
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Per message overhead of the chat format (role, separators).
+MESSAGE_TOKEN_OVERHEAD = 4
+
+ENCODER = None
+
+
+async def init_task():
+    global ENCODER
+    # The BPE file is downloaded on first use, fetch it off the event loop.
+    ENCODER = await asyncio.to_thread(get_encoder)
+
+
+def get_encoder():
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            # Azure deployments and custom model names.
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # BPE files couldn't be fetched.
+        return None
+
+
+def count_tokens(text: str) -> int:
+    tokens = len(ENCODER.encode(text)) if ENCODER else len(text) // 4
+    return tokens + MESSAGE_TOKEN_OVERHEAD
+
+
+class ChatHistory:
+    """
+    LRU of per chat-user histories, each trimmed from
+    the oldest side to stay within token_budget.
+    """
+
+    def __init__(self, max_chats: int, token_budget: int):
+        self.max_chats = max_chats
+        self.token_budget = token_budget
+        self._chats: OrderedDict[str, list[tuple[dict, int]]] = OrderedDict()
+
+    def _get(self, key: str) -> list[tuple[dict, int]]:
+        if key not in self._chats:
+            self._chats[key] = []
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(key)
+        return self._chats[key]
+
+    def add(self, key: str, role: str, content: str):
+        history = self._get(key)
+        history.append(({"role": role, "content": content}, count_tokens(content)))
+
+        total = sum(tokens for _, tokens in history)
+        while total > self.token_budget and len(history) > 1:
+            total -= history.pop(0)[1]
+
+    def get_messages(self, key: str) -> list[dict]:
+        system = {"role": "system", "content": SYSTEM_INSTRUCTION}
+        return [system, *(message for message, _ in self._get(key))]
+
+    def clear(self, key: str):
+        self._chats.pop(key, None)
+
+
+CHAT_HISTORY = ChatHistory(
+    max_chats=int(environ.get("OPENAI_MAX_CHATS", 50)),
+    token_budget=int(environ.get("OPENAI_HISTORY_TOKENS", 4000)),
+)
+
+CONVO_CACHE: dict[str, Convo] = {}
+
+
+@bot.add_cmd(cmd="gptc")
+async def chat_gpt_convo(bot: BOT, message: Message):
+    """
+    CMD: GPTC
+    INFO: Have a Conversation with chat gpt.
+
+    SETUP:
+        Same as .gpt, optionally:
+            OPENAI_HISTORY_TOKENS = max tokens of history sent per message (default 4000)
+            OPENAI_MAX_CHATS = number of chat histories kept in memory (default 50)
+
+    FLAGS:
+        -new: to discard the previous conversation of this chat.
+
+    USAGE:
+        .gptc hello
+        keep replying to responses with text [no need to reply in DM]
+        After 5 mins of Idle the chat stops.
+        use .gptc again to continue from where you left.
+    """
+    if TEXT_CLIENT is None:
+        await message.reply(f"OpenAI Creds not set or are invalid.\nCheck Help.")
+        return
+
+    prompt = message.filtered_input.strip()
+
+    if not prompt:
+        await message.reply("Ask a Question.")
+        return
+
+    history_key = message.unique_chat_user_id
+
+    if "-new" in message.flags:
+        CHAT_HISTORY.clear(history_key)
+
+    old_conversation = CONVO_CACHE.get(history_key)
+
+    if old_conversation in Convo.CONVO_DICT[message.chat.id]:
+        Convo.CONVO_DICT[message.chat.id].remove(old_conversation)
+
+    if message.chat.type in (ChatType.PRIVATE, ChatType.BOT):
+        reply_to_user_id = None
+    else:
+        reply_to_user_id = message._client.me.id
+
+    conversation_object = Convo(
+        client=message._client,
+        chat_id=message.chat.id,
+        timeout=300,
+        check_for_duplicates=False,
+        from_user=message.from_user.id,
+        reply_to_user_id=reply_to_user_id,
+    )
+
+    CONVO_CACHE[history_key] = conversation_object
+
+    try:
+        async with conversation_object:
+            prompt_message = message
+
+            while True:
+                response = await conversation_object.send_message(
+                    text="••>", reply_to_id=prompt_message.id, parse_mode=ParseMode.DISABLED
+                )
+                text = await stream_completion(
+                    messages=[
+                        *CHAT_HISTORY.get_messages(history_key),
+                        {"role": "user", "content": prompt},
+                    ],
+                    response=response,
+                    prefix="••> ",
+                )
+
+                # Only completed turns go in, a failed call leaves history as it was.
+                CHAT_HISTORY.add(history_key, "user", prompt)
+                CHAT_HISTORY.add(history_key, "assistant", text)
+
+                await send_final_text(
+                    message=prompt_message, response=response, text=f"**>\n••><**\n{text}"
+                )
+
+                prompt_message = await conversation_object.get_response()
+
+                while not prompt_message.text:
+                    await prompt_message.reply("Only text is supported in this chat.")
+                    prompt_message = await conversation_object.get_response()
+
+                prompt = prompt_message.text
+
+    except TimeoutError:
+        pass
+    finally:
+        CONVO_CACHE.pop(history_key, 0)
@@ -0,0 +1,201 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+import httpx
+from google.genai import types
+from google.genai.errors import ServerError
+
+from app.plugins.ai.gemini import AIConfig, async_client
+from app.plugins.ai.gemini.config import SYSTEM_INSTRUCTION
+from app.plugins.ai.gemini.scheduler import SCHEDULER
+from app.plugins.ai.stats import LatencyTracker, register_stats
+
+try:
+    import openai
+
+    OPENAI_ERRORS = (openai.InternalServerError, openai.APIConnectionError)
+except ImportError:
+    OPENAI_ERRORS = ()
+
+# Errors on which a query is retried on the next provider.
+FAILOVER_ERRORS = (TimeoutError, httpx.TimeoutException, ServerError, *OPENAI_ERRORS)
+
+PROVIDER_LATENCY = LatencyTracker()
+
+
+class Provider(ABC):
+    name: str = ""
+
+    # A provider is skipped for COOLDOWN seconds when
+    # at least half of its recent queries failed.
+    COOLDOWN = 60
+    MAX_ERROR_RATE = 0.5
+
+    # Seconds an API call may take, time queued locally doesn't count.
+    TIMEOUT = 60
+
+    def __init__(self):
+        self.outcomes: deque[bool] = deque(maxlen=20)
+        self.down_until = 0.0
+
+    @property
+    @abstractmethod
+    def available(self) -> bool: ...
+
+    @property
+    def healthy(self) -> bool:
+        return self.available and time.time() >= self.down_until
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def record(self, success: bool, latency: float | None = None):
+        self.outcomes.append(success)
+
+        if success:
+            PROVIDER_LATENCY.add(self.name, latency)
+        elif self.error_rate >= self.MAX_ERROR_RATE:
+            self.down_until = time.time() + self.COOLDOWN
+
+    async def call(self, coro):
+        """Await an API call with TIMEOUT and record its outcome and latency."""
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(coro, self.TIMEOUT)
+        except FAILOVER_ERRORS:
+            self.record(success=False)
+            raise
+
+        self.record(success=True, latency=time.perf_counter() - start)
+        return response
+
+    @abstractmethod
+    async def generate(self, contents: list[types.Part]) -> types.GenerateContentResponse:
+        """Answer a text-only prompt using SYSTEM_INSTRUCTION."""
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    QUEUE_TIMEOUT = 30
+
+    @property
+    def available(self) -> bool:
+        return async_client is not None
+
+    async def generate(self, contents: list[types.Part]) -> types.GenerateContentResponse:
+        kwargs = AIConfig.get_kwargs(flags=[])
+
+        async def generate_content(**call_kwargs):
+            # Timed from here, after the scheduler hands out a slot.
+            return await self.call(async_client.models.generate_content(**call_kwargs))
+
+        # Bounds the wait for a slot as well, that one is local so it isn't recorded.
+        return await asyncio.wait_for(
+            SCHEDULER.run(kwargs["model"], generate_content, contents=contents, **kwargs),
+            self.QUEUE_TIMEOUT + self.TIMEOUT,
+        )
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def __init__(self, client, model: str):
+        super().__init__()
+        self.client = client
+        self.model = model
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    async def generate(self, contents: list[types.Part]) -> types.GenerateContentResponse:
+        prompt = "\n\n".join(part.text for part in contents)
+
+        chat_completion = await self.call(
+            self.client.chat.completions.create(
+                messages=[
+                    {"role": "system", "content": SYSTEM_INSTRUCTION},
+                    {"role": "user", "content": prompt},
+                ],
+                model=self.model,
+            )
+        )
+
+        # Wrapped in Gemini's response type so both providers render the same way.
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(
+                        role="model",
+                        parts=[
+                            types.Part.from_text(text=chat_completion.choices[0].message.content)
+                        ],
+                    )
+                )
+            ]
+        )
+
+
+class ProviderRouter:
+    def __init__(self):
+        self.providers: dict[str, Provider] = {}
+
+    def register(self, provider: Provider):
+        self.providers[provider.name] = provider
+
+    @staticmethod
+    def can_route(config_key: str, contents: list[types.Part]) -> bool:
+        # Search, media and image/audio output are Gemini only.
+        return config_key == "text" and all(part.text is not None for part in contents)
+
+    def get_candidates(self, exclude: set[str] | None = None) -> list[Provider]:
+        exclude = exclude or set()
+        available = [p for p in self.providers.values() if p.available and p.name not in exclude]
+
+        # Providers without samples sort first so they get measured.
+        healthy = sorted(
+            (p for p in available if p.healthy),
+            key=lambda p: PROVIDER_LATENCY.percentile(p.name, 50) or 0,
+        )
+        # Unhealthy ones are still tried as a last resort.
+        return healthy + [p for p in available if not p.healthy]
+
+    async def generate(
+        self, contents: list[types.Part], exclude: set[str] | None = None
+    ) -> types.GenerateContentResponse:
+        """Query the fastest healthy provider and fail over on timeouts / 5xx."""
+        candidates = self.get_candidates(exclude)
+
+        if not candidates:
+            raise RuntimeError("No AI provider is configured.")
+
+        for provider in candidates:
+            try:
+                # Providers record their own health, from API time only.
+                return await provider.generate(contents)
+            except FAILOVER_ERRORS as e:
+                last_error = e
+
+        raise last_error
+
+
+ROUTER = ProviderRouter()
+ROUTER.register(GeminiProvider())
+
+
+@register_stats("AI Providers")
+def provider_stats() -> dict[str, str]:
+    stats = {}
+    for name, provider in ROUTER.providers.items():
+        if not provider.available:
+            continue
+        health = "healthy" if provider.healthy else "down"
+        stats[name] = f"{health} | errors {provider.error_rate:.0%}"
+        stats[f"{name} latency"] = PROVIDER_LATENCY.summary(name)
+    return stats
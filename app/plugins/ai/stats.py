@@ -0,0 +1,69 @@
+from collections import defaultdict, deque
+from statistics import quantiles
+from typing import Callable
+
+from app import BOT, Message, bot
+
+STATS_SECTIONS: dict[str, Callable[[], dict[str, str | int | float]]] = {}
+
+
+def register_stats(section: str):
+    """Register a callable that returns the current stats of an AI component."""
+
+    def decorator(func: Callable[[], dict[str, str | int | float]]):
+        STATS_SECTIONS[section] = func
+        return func
+
+    return decorator
+
+
+class LatencyTracker:
+    """Keeps the last `window` samples per key to compute percentiles."""
+
+    def __init__(self, window: int = 100):
+        self.samples: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, key: str, seconds: float):
+        self.samples[key].append(seconds)
+
+    def percentile(self, key: str, percent: int) -> float | None:
+        samples = self.samples.get(key)
+
+        if not samples:
+            return None
+
+        if len(samples) == 1:
+            return samples[0]
+
+        return quantiles(samples, n=100, method="inclusive")[percent - 1]
+
+    def summary(self, key: str) -> str:
+        p50, p95 = self.percentile(key, 50), self.percentile(key, 95)
+        if p50 is None:
+            return "N/A"
+        return f"p50 {p50:.2f}s | p95 {p95:.2f}s ({len(self.samples[key])} samples)"
+
+
+@bot.add_cmd(cmd="aistats")
+async def ai_stats(bot: BOT, message: Message):
+    """
+    CMD: AISTATS
+    INFO: View usage stats of AI plugins since last restart.
+    USAGE: .aistats
+    """
+    output = ""
+
+    for section, stats_func in STATS_SECTIONS.items():
+        stats = stats_func()
+        if not stats:
+            continue
+
+        output += f"\n\n<b>{section}</b>"
+        for key, value in stats.items():
+            output += f"\n  {key}: <code>{value}</code>"
+
+    if not output:
+        await message.reply("No AI stats recorded yet.")
+        return
+
+    await message.reply(f"<b>AI Stats</b>:{output}", del_in=60)
@@ -22,6 +22,33 @@ def parse_link(link: str) -> tuple[int | str, int, int]:
     return chat, thread, int(message)
 
 
+async def get_message_batch(message: Message, count: int = 0) -> list[Message]:
+    """
+    count: the replied message and the ones after it or
+        the last <count> messages if not replied.
+    Album: every item in the replied media group.
+    """
+    client = message._client
+    reply = message.replied
+
+    if count:
+        start = reply.id if reply else max(1, message.id - count)
+        end = min(start + count, message.id)
+        messages = await client.get_messages(
+            chat_id=message.chat.id, message_ids=list(range(start, end)), replies=0
+        )
+        # PMs and basic groups share one id sequence across the account,
+        # the range can hold messages from other chats.
+        return [
+            msg for msg in messages if not msg.empty and msg.chat and msg.chat.id == message.chat.id
+        ]
+
+    if reply and reply.media_group_id:
+        return await client.get_media_group(chat_id=message.chat.id, message_id=reply.id)
+
+    return []
+
+
 @BOT.add_cmd(cmd="gm")
 async def get_message(bot: BOT, message: Message):
     """
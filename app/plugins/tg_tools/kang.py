@@ -1,14 +1,11 @@
 import asyncio
 import os
 import random
-import shutil
-import time
 from io import BytesIO
-from pathlib import Path
+from mimetypes import guess_type
 
-from PIL import Image
 from pyrogram.enums import MessageMediaType
-from pyrogram.errors import StickersetInvalid
+from pyrogram.errors import FloodWait, ShortnameOccupyFailed, StickersetInvalid, StickersTooMuch
 from pyrogram.raw import functions
 from pyrogram.raw import types as raw_types
 from pyrogram.raw.base.messages import StickerSet as BaseStickerSet
@@ -16,83 +13,73 @@ from pyrogram.types import User
 from pyrogram.utils import FileId
 from ub_core import utils as core_utils
 
-from app import BOT, Config, Message, bot, extra_config
+from app import BOT, Config, CustomDB, Message, bot, extra_config
+from app.plugins.tg_tools.get_message import get_message_batch
+from app.plugins.tg_tools.sticker_utils import make_video_sticker, resize_photo
 
 EMOJIS = ("☕", "🤡", "🙂", "🤔", "🔪", "😂", "💀")
 
+PACK_LIMIT = 120
 
-async def save_sticker(file: Path | BytesIO) -> str:
-    client = getattr(bot, "bot", bot)
-
-    sent_file = await client.send_document(
-        chat_id=Config.LOG_CHAT, document=file, message_thread_id=Config.LOG_CHAT_THREAD_ID
-    )
+# CreateStickerSet takes at most 50 stickers, the rest go in one by one.
+CREATE_SET_LIMIT = 50
 
-    if isinstance(file, Path) and file.is_file():
-        shutil.rmtree(file.parent, ignore_errors=True)
+MAX_BATCH_SIZE = 120
 
-    return sent_file.document.file_id
+# Files converted at once in a batch kang.
+CONVERT_SEMAPHORE = asyncio.Semaphore(os.cpu_count() or 1)
 
+# Seconds between AddStickerToSet calls in a batch.
+ADD_STICKER_INTERVAL = 1
 
-def resize_photo(input_file: BytesIO) -> BytesIO:
-    image = Image.open(input_file)
-    maxsize = 512
-    scale = maxsize / max(image.width, image.height)
-    new_size = (int(image.width * scale), int(image.height * scale))
-    image = image.resize(new_size, Image.LANCZOS)
-    resized_photo = BytesIO()
-    resized_photo.name = "sticker.png"
-    image.save(resized_photo, format="PNG")
-    return resized_photo
+PACK_DB = CustomDB["KANG_PACK_INDEX"]
 
+# "{user_id}{suffix}" -> {"pack": pack number in use, "count": stickers in it}
+PACK_INDEX: dict[str, dict[str, int]] = {}
 
-async def photo_kang(message: Message, **_) -> tuple[str, None]:
-    file = await message.download(in_memory=True)
-    file.seek(0)
-    resized_file = await asyncio.to_thread(resize_photo, file)
-    return await save_sticker(resized_file), None
 
+async def save_sticker(file: BytesIO) -> raw_types.InputDocument:
+    """Upload straight to Telegram's storage without sending a message anywhere."""
+    client = getattr(bot, "bot", bot)
 
-async def video_kang(message: Message, ff=False) -> tuple[str, None]:
-    video = message.video or message.animation or message.document
-
-    if video.file_size > 5242880:
-        raise MemoryError("File Size exceeds 5MB.")
+    uploaded_media = await client.invoke(
+        functions.messages.UploadMedia(
+            peer=await client.resolve_peer(Config.LOG_CHAT),
+            media=raw_types.InputMediaUploadedDocument(
+                file=await client.save_file(file),
+                mime_type=guess_type(file.name)[0] or "application/octet-stream",
+                attributes=[raw_types.DocumentAttributeFilename(file_name=file.name)],
+            ),
+        )
+    )
 
-    download_path = Path("downloads") / str(time.time())
-    input_file = download_path / "input.mp4"
-    output_file = download_path / "sticker.webm"
+    document = uploaded_media.document
 
-    download_path.mkdir(parents=True, exist_ok=True)
+    return raw_types.InputDocument(
+        id=document.id, access_hash=document.access_hash, file_reference=document.file_reference
+    )
 
-    await message.download(str(input_file))
 
-    duration = getattr(video, "duration", None)
-    if not duration:
-        duration = await core_utils.get_duration(file=str(input_file))
+def get_input_document(file_id: str) -> raw_types.InputDocument:
+    decoded_file_id = FileId.decode(file_id)
+    return raw_types.InputDocument(
+        access_hash=decoded_file_id.access_hash,
+        id=decoded_file_id.media_id,
+        file_reference=decoded_file_id.file_reference,
+    )
 
-    await resize_video(input_file=input_file, output_file=output_file, duration=duration, ff=ff)
 
-    return await save_sticker(output_file), None
+async def photo_kang(message: Message, **_) -> tuple[raw_types.InputDocument, None]:
+    file = await message.download(in_memory=True)
+    resized_file = await resize_photo(file.getvalue())
+    return await save_sticker(resized_file), None
 
 
-async def resize_video(
-    input_file: Path | str, output_file: Path | str, duration: int, ff: bool = False
-):
-    cmd = f"ffmpeg -hide_banner -loglevel error -i '{input_file}' -vf "
-    if ff:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease,setpts=0.3*PTS" '
-        cmd += "-ss 0 -t 3 -r 30 -loop 0 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    elif duration < 3:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease" '
-        cmd += "-ss 0 -r 30 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    else:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease" '
-        cmd += "-ss 0 -t 3 -r 30 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    await core_utils.run_shell_cmd(cmd=f"{cmd}'{output_file}'")
+async def video_kang(message: Message, ff=False) -> tuple[raw_types.InputDocument, None]:
+    return await save_sticker(await make_video_sticker(message=message, ff=ff)), None
 
 
-async def document_kang(message: Message, ff: bool = False) -> tuple[str, None]:
+async def document_kang(message: Message, ff: bool = False) -> tuple[raw_types.InputDocument, None]:
     name, ext = os.path.splitext(core_utils.get_tg_media_details(message).file_name)
     if ext.lower() in core_utils.MediaExts.PHOTO:
         return await photo_kang(message)
@@ -100,11 +87,11 @@ async def document_kang(message: Message, ff: bool = False) -> tuple[str, None]:
         return await video_kang(message=message, ff=ff)
 
 
-async def sticker_kang(message: Message, **_) -> tuple[str, str]:
+async def sticker_kang(message: Message, **_) -> tuple[raw_types.InputDocument, str]:
     sticker = message.sticker
     if sticker.is_animated:
         raise TypeError("Animated Stickers Not Supported.")
-    return sticker.file_id, sticker.emoji
+    return get_input_document(sticker.file_id), sticker.emoji
 
 
 MEDIA_TYPE_MAP = {
@@ -116,80 +103,171 @@ MEDIA_TYPE_MAP = {
 }
 
 
-async def get_sticker_set(
-    client: BOT, user: User
-) -> tuple[str, str, bool, raw_types.StickerSet | None]:
-    count = 0
-    create_new = False
-    suffix = f"_by_{client.me.username}" if client.is_bot else ""
+async def get_pack_index(key: str) -> dict[str, int] | None:
+    if key not in PACK_INDEX:
+        if pack_info := await PACK_DB.find_one({"_id": key}):
+            PACK_INDEX[key] = {"pack": pack_info["pack"], "count": pack_info["count"]}
+    return PACK_INDEX.get(key)
+
+
+async def update_pack_index(key: str, pack: int, count: int):
+    if count >= PACK_LIMIT:
+        # Full, next kang creates the next pack.
+        pack, count = pack + 1, 0
+    PACK_INDEX[key] = {"pack": pack, "count": count}
+    await PACK_DB.add_data({"_id": key, "pack": pack, "count": count})
+
+
+async def find_sticker_set(client: BOT, prefix: str, suffix: str) -> tuple[int, int]:
+    """Probe packs from 0 for the first one with space, returns its number and count."""
+    pack = 0
 
     while True:
-        shortname = f"P_UB_{user.id}_mixpack_{count}{suffix}"
         try:
             sticker_set: BaseStickerSet = await client.invoke(
                 functions.messages.GetStickerSet(
-                    stickerset=raw_types.InputStickerSetShortName(short_name=shortname),
+                    stickerset=raw_types.InputStickerSetShortName(
+                        short_name=f"{prefix}{pack}{suffix}"
+                    ),
                     hash=0,
                 )
             )
-            sticker_set = sticker_set.set
-            if sticker_set.count < 120:
-                break
-            count += 1
+            if sticker_set.set.count < PACK_LIMIT:
+                return pack, sticker_set.set.count
+            pack += 1
         except StickersetInvalid:
-            create_new = True
-            sticker_set: BaseStickerSet | None = None
-            break
+            return pack, 0
 
-    if extra_config.CUSTOM_PACK_NAME:
-        pack_title = extra_config.CUSTOM_PACK_NAME
-    else:
-        pack_title = f"{user.username or core_utils.get_name(user)}'s kang pack vol {count}"
 
-    return shortname, pack_title, create_new, sticker_set
+async def get_sticker_set(
+    client: BOT, user: User, revalidate: bool = False
+) -> tuple[str, str, bool, str, int]:
+    prefix = f"P_UB_{user.id}_mixpack_"
+    suffix = f"_by_{client.me.username}" if client.is_bot else ""
+    index_key = f"{user.id}{suffix}"
 
+    pack_index = None if revalidate else await get_pack_index(index_key)
 
-async def kang_sticker(
-    client: BOT, media_file_id: str, emoji: str = None, user: User = None
-) -> BaseStickerSet:
-    shortname, pack_title, create_new, sticker_set = await get_sticker_set(client, user)
+    if pack_index is None:
+        pack, count = await find_sticker_set(client, prefix, suffix)
+        await update_pack_index(index_key, pack, count)
+    else:
+        pack, count = pack_index["pack"], pack_index["count"]
+
+    if extra_config.CUSTOM_PACK_NAME:
+        pack_title = extra_config.CUSTOM_PACK_NAME
+    else:
+        pack_title = f"{user.username or core_utils.get_name(user)}'s kang pack vol {pack}"
 
-    file_id = FileId.decode(media_file_id)
+    return f"{prefix}{pack}{suffix}", pack_title, count == 0, index_key, pack
 
-    document = raw_types.InputDocument(
-        access_hash=file_id.access_hash,
-        id=file_id.media_id,
-        file_reference=file_id.file_reference,
-    )
 
-    set_item = raw_types.InputStickerSetItem(
-        document=document, emoji=emoji or random.choice(EMOJIS)
+async def add_to_sticker_set(
+    client: BOT,
+    set_items: list[raw_types.InputStickerSetItem],
+    user: User,
+    revalidate: bool = False,
+) -> tuple[BaseStickerSet, int]:
+    """
+    A new pack is created with up to CREATE_SET_LIMIT items in one call,
+    an existing one gets the first item. Returns the set and items used.
+    """
+    shortname, pack_title, create_new, index_key, pack = await get_sticker_set(
+        client, user, revalidate=revalidate
     )
 
     if create_new:
+        set_items = set_items[:CREATE_SET_LIMIT]
         query = functions.stickers.CreateStickerSet(
             user_id=await bot.resolve_peer(peer_id=user.id),
             short_name=shortname,
             title=pack_title,
-            stickers=[set_item],
+            stickers=set_items,
         )
     else:
+        set_items = set_items[:1]
         query = functions.stickers.AddStickerToSet(
-            stickerset=raw_types.InputStickerSetID(
-                id=sticker_set.id, access_hash=sticker_set.access_hash
-            ),
-            sticker=set_item,
+            stickerset=raw_types.InputStickerSetShortName(short_name=shortname),
+            sticker=set_items[0],
         )
 
-    return await client.invoke(query)
+    sticker_set: BaseStickerSet = await client.invoke(query)
+    await update_pack_index(index_key, pack, sticker_set.set.count)
+    return sticker_set, len(set_items)
+
+
+async def kang_stickers(
+    client: BOT, set_items: list[raw_types.InputStickerSetItem], user: User
+) -> list[str]:
+    """Add all items to the user's packs, rolling over to new ones as they fill up."""
+    short_names = []
+
+    while set_items:
+        try:
+            sticker_set, added = await add_to_sticker_set(client, set_items, user)
+        except (StickersetInvalid, StickersTooMuch, ShortnameOccupyFailed):
+            # Cached index is stale: pack deleted, filled from elsewhere or name taken.
+            sticker_set, added = await add_to_sticker_set(client, set_items, user, revalidate=True)
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+            continue
+
+        set_items = set_items[added:]
+
+        if sticker_set.set.short_name not in short_names:
+            short_names.append(sticker_set.set.short_name)
+
+        if set_items:
+            await asyncio.sleep(ADD_STICKER_INTERVAL)
+
+    return short_names
+
+
+def get_set_item(
+    document: raw_types.InputDocument, emoji: str = None
+) -> raw_types.InputStickerSetItem:
+    return raw_types.InputStickerSetItem(document=document, emoji=emoji or random.choice(EMOJIS))
+
+
+async def get_kang_messages(message: Message) -> list[Message]:
+    """
+    -n <count> messages or the replied album, see get_message_batch.
+    Otherwise just the replied message.
+    """
+    count = 0
+
+    if "-n" in message.flags:
+        count = message.filtered_input.strip()
+
+        if not count.isdigit():
+            raise ValueError("Give a message count with -n: .kang -n 10")
+
+        count = min(int(count), MAX_BATCH_SIZE)
+
+    if (messages := await get_message_batch(message=message, count=count)) or count:
+        return messages
+
+    return [message.replied] if message.replied else []
+
+
+async def convert_media(message: Message, ff: bool = False) -> raw_types.InputStickerSetItem:
+    async with CONVERT_SEMAPHORE:
+        document, emoji = await MEDIA_TYPE_MAP[message.media](message=message, ff=ff)
+    return get_set_item(document, emoji)
 
 
 async def kang(bot: BOT, message: Message):
     """
     CMD: KANG
     INFO: Save a sticker/image/gif/video to your sticker pack.
-    FLAGS: -f to fastforward video tp fit 3 sec duration.
-    USAGE: .kang | .kang -f
+    FLAGS:
+        -f to fastforward video tp fit 3 sec duration.
+        -n <count> to kang multiple messages.
+    USAGE:
+        .kang | .kang -f
+        .kang -n 20 (kangs last 20 messages)
+        .kang -n 20 [reply to a message] (kangs replied + next 19 messages)
+        .kang [reply to an album] (kangs every item in the album)
 
     Diffrences to legacy version:
         • Is almost instantaneous because uses built-in methods.
@@ -200,28 +278,47 @@ async def kang(bot: BOT, message: Message):
 
     Note: if you still would like to use old style set USE_LEGACY_KANG=1
     """
-    replied = message.replied
+    try:
+        messages = await get_kang_messages(message)
+    except ValueError as e:
+        await message.reply(str(e))
+        return
 
-    media_func = MEDIA_TYPE_MAP.get(replied.media)
+    messages = [msg for msg in messages if MEDIA_TYPE_MAP.get(msg.media)]
 
-    if not media_func:
+    if not messages:
         await message.reply("<code>Unsupported Media...</code>")
         return
 
-    response = await message.reply("<code>Processing...</code>")
+    response = await message.reply(f"<code>Processing {len(messages)} file(s)...</code>")
 
     bot = getattr(bot, "bot", bot)
+    ff = "-f" in message.flags
+
+    results = await asyncio.gather(
+        *[convert_media(message=msg, ff=ff) for msg in messages], return_exceptions=True
+    )
 
-    file_id, emoji = await media_func(message=replied, ff="-f" in message.flags)
+    set_items = [result for result in results if isinstance(result, raw_types.InputStickerSetItem)]
+
+    if not set_items:
+        await response.edit(str(results[0]))
+        return
 
     try:
-        stickers = await kang_sticker(bot, file_id, emoji, user=message.from_user)
-        await response.edit(
-            f"Kanged: <a href='t.me/addstickers/{stickers.set.short_name}'>here</a>",
-            disable_preview=True,
-        )
+        short_names = await kang_stickers(bot, set_items, user=message.from_user)
     except Exception as e:
         await response.edit(str(e))
+        return
+
+    text = "Kanged: " + ", ".join(
+        f"<a href='t.me/addstickers/{short_name}'>here</a>" for short_name in short_names
+    )
+
+    if failed := len(results) - len(set_items):
+        text += f"\nFailed to convert {failed} file(s)."
+
+    await response.edit(text, disable_preview=True)
 
 
 if not extra_config.USE_LEGACY_KANG:
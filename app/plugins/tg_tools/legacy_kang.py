@@ -1,108 +1,99 @@
 import asyncio
 import os
 import random
-import shutil
-import time
 from io import BytesIO
 
-from PIL import Image
 from pyrogram import raw
 from pyrogram.enums import MessageMediaType
 from pyrogram.errors import StickersetInvalid
 from ub_core import utils as core_utils
 
-from app import BOT, Message, bot, extra_config
+from app import BOT, Config, Message, bot, extra_config
+from app.plugins.tg_tools.sticker_utils import make_video_sticker, resize_photo
 
 EMOJIS = ("☕", "🤡", "🙂", "🤔", "🔪", "😂", "💀")
 
 
-async def get_sticker_set(limit: int, is_video=False) -> tuple[str, str, bool]:
-    count = 0
-    pack_name = f"PUB_{bot.me.id}_pack"
+# Requests arriving within this window share one @Stickers session.
+BATCH_WINDOW = 1
+
+KANG_QUEUE: asyncio.Queue[dict] = asyncio.Queue()
+
+# is_video -> {"pack": pack number in use, "count": stickers in it}
+PACK_STATE: dict[bool, dict[str, int]] = {}
+
+
+async def init_task():
+    if extra_config.USE_LEGACY_KANG:
+        ensure_worker()
+
+
+def ensure_worker():
+    """Start the queue worker, or restart it if it died."""
+    for task in Config.BACKGROUND_TASKS:
+        if task.get_name() == "legacy_kang" and not task.done():
+            return
+    Config.BACKGROUND_TASKS.append(asyncio.create_task(kang_worker(), name="legacy_kang"))
+
+
+def resolve(kwargs: dict, result: str | None = None, error: Exception | None = None):
+    future: asyncio.Future = kwargs["future"]
+    # Done already if resolved earlier in the session or the command was cancelled.
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+def get_pack_names(pack: int, is_video: bool = False) -> tuple[str, str]:
     video = "_video" if is_video else ""
-    create_new = False
+    if cus_nick := os.environ.get("CUSTOM_PACK_NAME"):
+        pack_title = cus_nick + video
+    else:
+        pack_title = (
+            f"{bot.me.username or core_utils.get_name(bot.me)}'s {video}kang pack vol {pack}"
+        )
+    return pack_title, f"PUB_{bot.me.id}_pack{video}_{pack}"
+
+
+async def find_sticker_set(limit: int, is_video=False) -> tuple[int, int]:
+    """Probe packs from 0 for the first one with space, returns its number and count."""
+    pack = 0
     while True:
         try:
             sticker = await bot.invoke(
                 raw.functions.messages.GetStickerSet(
                     stickerset=raw.types.InputStickerSetShortName(
-                        short_name=f"{pack_name}{video}_{count}"
+                        short_name=get_pack_names(pack, is_video)[1]
                     ),
                     hash=0,
                 )
             )
             if sticker.set.count < limit:
-                break
-            count += 1
+                return pack, sticker.set.count
+            pack += 1
         except StickersetInvalid:
-            create_new = True
-            break
-    if cus_nick := os.environ.get("CUSTOM_PACK_NAME"):
-        pack_title = cus_nick + video
-    else:
-        pack_title = (
-            f"{bot.me.username or core_utils.get_name(bot.me)}'s {video}kang pack vol {count}"
-        )
-    return pack_title, f"{pack_name}{video}_{count}", create_new
-
-
-async def photo_kang(message: Message, **_) -> dict:
-    download_path = os.path.join("downloads", str(time.time()))
-    os.makedirs(download_path, exist_ok=True)
+            return pack, 0
 
-    input_file = os.path.join(download_path, "photo.jpg")
-    await message.download(input_file)
 
-    file = await asyncio.to_thread(resize_photo, input_file)
+async def get_pack_state(limit: int, is_video=False) -> dict[str, int]:
+    if is_video not in PACK_STATE:
+        pack, count = await find_sticker_set(limit=limit, is_video=is_video)
+        PACK_STATE[is_video] = {"pack": pack, "count": count}
+    return PACK_STATE[is_video]
 
-    return dict(cmd="/newpack", limit=120, is_video=False, file=file, path=download_path)
 
-
-def resize_photo(input_file: str) -> BytesIO:
-    image = Image.open(input_file)
-    maxsize = 512
-    scale = maxsize / max(image.width, image.height)
-    new_size = (int(image.width * scale), int(image.height * scale))
-    image = image.resize(new_size, Image.LANCZOS)
-    resized_photo = BytesIO()
-    resized_photo.name = "sticker.png"
-    image.save(resized_photo, format="PNG")
-    return resized_photo
+async def photo_kang(message: Message, **_) -> dict:
+    input_file: BytesIO = await message.download(in_memory=True)
+    file = await resize_photo(input_file.getvalue())
+    return dict(cmd="/newpack", limit=120, is_video=False, file=file)
 
 
 async def video_kang(message: Message, ff=False) -> dict:
-    video = message.video or message.animation or message.document
-    if video.file_size > 5242880:
-        raise MemoryError("File Size exceeds 5MB.")
-
-    download_path = os.path.join("downloads", f"{time.time()}")
-    os.makedirs(download_path, exist_ok=True)
-
-    input_file = os.path.join(download_path, "input.mp4")
-    output_file = os.path.join(download_path, "sticker.webm")
-
-    await message.download(input_file)
-
-    if not hasattr(video, "duration"):
-        duration = await core_utils.get_duration(file=input_file)
-    else:
-        duration = video.duration
-    await resize_video(input_file=input_file, output_file=output_file, duration=duration, ff=ff)
-    return dict(cmd="/newvideo", limit=50, is_video=True, file=output_file, path=download_path)
-
-
-async def resize_video(input_file: str, output_file: str, duration: int, ff: bool = False):
-    cmd = f"ffmpeg -hide_banner -loglevel error -i '{input_file}' -vf "
-    if ff:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease,setpts=0.3*PTS" '
-        cmd += "-ss 0 -t 3 -r 30 -loop 0 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    elif duration < 3:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease" '
-        cmd += "-ss 0 -r 30 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    else:
-        cmd += '"scale=w=512:h=512:force_original_aspect_ratio=decrease" '
-        cmd += "-ss 0 -t 3 -r 30 -an -c:v libvpx-vp9 -b:v 256k -fs 256k "
-    await core_utils.run_shell_cmd(cmd=f"{cmd}'{output_file}'")
+    file = await make_video_sticker(message=message, ff=ff)
+    return dict(cmd="/newvideo", limit=50, is_video=True, file=file)
 
 
 async def document_kang(message: Message, ff: bool = False) -> dict:
@@ -137,26 +128,101 @@ MEDIA_TYPE_MAP = {
 }
 
 
-async def create_n_kang(kwargs: dict, pack_title: str, pack_name: str, message: Message):
+async def send_sticker(convo, kwargs: dict):
+    if kwargs.get("sticker"):
+        await kwargs["message"].copy(chat_id="stickers", caption="")
+        await convo.get_response()
+    else:
+        await convo.send_document(document=kwargs["file"], get_response=True)
+
+    await convo.send_message(text=kwargs.get("emoji") or random.choice(EMOJIS), get_response=True)
+
+
+async def create_n_kang(requests: list[dict], pack_title: str, pack_name: str):
     async with bot.Convo(client=bot, chat_id="stickers", timeout=5) as convo:
-        await convo.send_message(text=kwargs["cmd"], get_response=True)
+        await convo.send_message(text=requests[0]["cmd"], get_response=True)
         await convo.send_message(text=pack_title, get_response=True)
 
-        if kwargs.get("sticker"):
-            await message.reply_to_message.copy(chat_id="stickers", caption="")
-            await convo.get_response()
-        else:
-            await convo.send_document(document=kwargs["file"], get_response=True)
+        for kwargs in requests:
+            await send_sticker(convo=convo, kwargs=kwargs)
 
-        await convo.send_message(
-            text=kwargs.get("emoji") or random.choice(EMOJIS), get_response=True
-        )
         await convo.send_message(text="/publish", get_response=True)
         await convo.send_message("/skip")
         await convo.send_message(pack_name, get_response=True)
 
-    if kwargs.get("path"):
-        shutil.rmtree(kwargs["path"], ignore_errors=True)
+    # Nothing exists until the pack is published and named.
+    for kwargs in requests:
+        resolve(kwargs, result=pack_name)
+
+
+async def add_n_kang(requests: list[dict], pack_name: str):
+    async with bot.Convo(client=bot, chat_id="stickers", timeout=5) as convo:
+        await convo.send_message(text="/addsticker", get_response=True)
+        await convo.send_message(text=pack_name, get_response=True)
+
+        for kwargs in requests:
+            await send_sticker(convo=convo, kwargs=kwargs)
+            # In the pack as soon as @Stickers has its emoji.
+            resolve(kwargs, result=pack_name)
+
+        await convo.send_message(text="/done", get_response=True)
+
+
+async def kang_batch(requests: list[dict]):
+    """Kang same type requests, one session per pack they land in."""
+    limit, is_video = requests[0]["limit"], requests[0]["is_video"]
+
+    while requests:
+        state = await get_pack_state(limit=limit, is_video=is_video)
+        pack_title, pack_name = get_pack_names(pack=state["pack"], is_video=is_video)
+
+        room = limit - state["count"]
+        batch, requests = requests[:room], requests[room:]
+
+        try:
+            if state["count"] == 0:
+                await create_n_kang(requests=batch, pack_title=pack_title, pack_name=pack_name)
+            else:
+                await add_n_kang(requests=batch, pack_name=pack_name)
+        except Exception as e:
+            # @Stickers went off script, re-probe packs on next run.
+            PACK_STATE.pop(is_video, None)
+            # Stickers added before the failure keep their result, only the rest fail.
+            for kwargs in batch:
+                resolve(kwargs, error=e)
+            continue
+
+        state["count"] += len(batch)
+        if state["count"] >= limit:
+            state.update(pack=state["pack"] + 1, count=0)
+
+
+async def kang_worker():
+    while True:
+        requests = [await KANG_QUEUE.get()]
+
+        await asyncio.sleep(BATCH_WINDOW)
+
+        while not KANG_QUEUE.empty():
+            requests.append(KANG_QUEUE.get_nowait())
+
+        try:
+            for is_video in (False, True):
+                batch = [kwargs for kwargs in requests if kwargs["is_video"] == is_video]
+
+                if not batch:
+                    continue
+
+                try:
+                    await kang_batch(batch)
+                except Exception as e:
+                    bot.log.error(f"Legacy kang batch failed: {e}", exc_info=e)
+                    for kwargs in batch:
+                        resolve(kwargs, error=e)
+        finally:
+            # Worker stopped mid-batch, don't leave the commands waiting.
+            for kwargs in requests:
+                resolve(kwargs, error=RuntimeError("Kang worker stopped, try again."))
 
 
 async def kang_sticker(bot: BOT, message: Message):
@@ -177,36 +243,17 @@ async def kang_sticker(bot: BOT, message: Message):
     response: Message = await message.reply("<code>Processing...</code>")
 
     kwargs: dict = await media_func(message=replied, ff="-f" in message.flags)
+    kwargs.update(message=replied, future=asyncio.get_running_loop().create_future())
 
-    pack_title, pack_name, create_new = await get_sticker_set(
-        limit=kwargs["limit"], is_video=kwargs["is_video"]
-    )
+    ensure_worker()
+    await KANG_QUEUE.put(kwargs)
 
-    if create_new:
-        await create_n_kang(
-            kwargs=kwargs, pack_title=pack_title, pack_name=pack_name, message=message
-        )
-        await response.edit(text=f"Kanged: <a href='t.me/addstickers/{pack_name}'>here</a>")
+    try:
+        pack_name = await kwargs["future"]
+    except Exception as e:
+        await response.edit(str(e))
         return
 
-    async with bot.Convo(client=bot, chat_id="stickers", timeout=5) as convo:
-        await convo.send_message(text="/addsticker", get_response=True)
-        await convo.send_message(text=pack_name, get_response=True)
-
-        if kwargs.get("sticker"):
-            await replied.copy(chat_id="stickers", caption="")
-            await convo.get_response()
-        else:
-            await convo.send_document(document=kwargs["file"], get_response=True)
-
-        await convo.send_message(
-            text=kwargs.get("emoji") or random.choice(EMOJIS), get_response=True
-        )
-        await convo.send_message(text="/done", get_response=True)
-
-    if kwargs.get("path"):
-        shutil.rmtree(kwargs["path"], ignore_errors=True)
-
     await response.edit(
         text=f"Kanged: <a href='t.me/addstickers/{pack_name}'>here</a>", disable_preview=True
     )
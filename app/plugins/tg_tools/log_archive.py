@@ -0,0 +1,85 @@
+import sqlite3
+import time
+from html import escape
+
+# Relevance weights for the text, sender and chat columns.
+BM25_WEIGHTS = "10.0, 2.0, 1.0"
+
+# FTS5 'optimize' rewrites the whole index, so at most once a day.
+OPTIMIZE_INTERVAL = 86400
+
+
+class LogArchive:
+    """Full-text index (SQLite FTS5) of everything the PM/Tag logger logged."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self.optimized_at = 0.0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS archive USING fts5("
+                "text, sender, chat, link UNINDEXED, date UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+        return self._db
+
+    def add(self, rows: list[tuple[str, str, str, str, float]]):
+        """Insert (text, sender, chat, link, date) rows in one transaction."""
+        with self.db:
+            self.db.executemany("INSERT INTO archive VALUES (?, ?, ?, ?, ?)", rows)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, str, str, float, str]]:
+        """
+        Every word must match, as a prefix. Returns (sender, chat, link, date, snippet)
+        best match first, snippet is HTML escaped with matches in bold.
+        """
+        match = " ".join('"{}"*'.format(word.replace('"', '""')) for word in query.split())
+
+        if not match:
+            return []
+
+        results = self.db.execute(
+            "SELECT sender, chat, link, date, snippet(archive, 0, char(1), char(2), '…', 16) "
+            f"FROM archive WHERE archive MATCH ? ORDER BY bm25(archive, {BM25_WEIGHTS}) LIMIT ?",
+            (match, limit),
+        ).fetchall()
+
+        return [
+            (
+                sender,
+                chat,
+                link,
+                date,
+                escape(snippet).replace("\x01", "<b>").replace("\x02", "</b>"),
+            )
+            for sender, chat, link, date, snippet in results
+        ]
+
+    def prune(self, days: int) -> int:
+        """Drop rows older than days, merge index segments only if any were dropped."""
+        with self.db:
+            deleted = self.db.execute(
+                "DELETE FROM archive WHERE date < ?", (time.time() - days * 86400,)
+            ).rowcount
+
+        if deleted and time.time() - self.optimized_at > OPTIMIZE_INTERVAL:
+            with self.db:
+                self.db.execute("INSERT INTO archive(archive) VALUES ('optimize')")
+            self.optimized_at = time.time()
+
+        return deleted
+
+    async def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+ARCHIVE = LogArchive("log_archive.db")
@@ -0,0 +1,67 @@
+import sqlite3
+import time
+from collections.abc import Iterable
+
+
+class LogSpool:
+    """
+    Pending PM/Tag log entries on disk so they survive restarts.
+
+    Only ids are stored, messages are re-fetched on load.
+    An entry stays until the logger acks it, so delivery is at-least-once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self.compacted_at = time.time()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            # WAL + NORMAL: appends are a cheap sequential write without an fsync each.
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, kind TEXT NOT NULL, "
+                "added_at REAL NOT NULL, PRIMARY KEY (chat_id, message_id)) WITHOUT ROWID"
+            )
+        return self._db
+
+    def add(self, chat_id: int, message_id: int, kind: str):
+        self.db.execute(
+            "INSERT OR IGNORE INTO spool VALUES (?, ?, ?, ?)",
+            (chat_id, message_id, kind, time.time()),
+        )
+
+    def ack(self, chat_id: int, message_ids: Iterable[int]):
+        self.db.executemany(
+            "DELETE FROM spool WHERE chat_id = ? AND message_id = ?",
+            [(chat_id, message_id) for message_id in message_ids],
+        )
+
+    def pending(self) -> dict[int, list[tuple[int, str]]]:
+        """{chat_id: [(message_id, kind), ...]} in the order they were added."""
+        entries: dict[int, list[tuple[int, str]]] = {}
+        for chat_id, message_id, kind in self.db.execute(
+            "SELECT chat_id, message_id, kind FROM spool ORDER BY added_at"
+        ):
+            entries.setdefault(chat_id, []).append((message_id, kind))
+        return entries
+
+    def compact(self):
+        """Fold the WAL back into the db and truncate it, reclaim space once drained."""
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if self.db.execute("SELECT 1 FROM spool LIMIT 1").fetchone() is None:
+            self.db.execute("VACUUM")
+        self.compacted_at = time.time()
+
+    async def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+SPOOL = LogSpool("log_spool.db")
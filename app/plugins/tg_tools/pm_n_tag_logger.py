@@ -1,18 +1,87 @@
 import asyncio
-from collections import defaultdict
-
-from pyrogram import filters
-from pyrogram.enums import ChatType, MessageEntityType, ParseMode
-from pyrogram.errors import MessageIdInvalid
+import re
+import time
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+from html import escape
+from itertools import islice
+
+from pyrogram import filters, raw
+from pyrogram.enums import ChatType, ParseMode
+from pyrogram.errors import BadRequest, FloodWait, Forbidden, MessageIdInvalid
 from ub_core.utils.helpers import get_name
 
 from app import BOT, Config, CustomDB, Message, bot, extra_config
+from app.plugins.tg_tools.log_archive import ARCHIVE
+from app.plugins.tg_tools.log_spool import SPOOL
 
 LOGGER = CustomDB["COMMON_SETTINGS"]
 
-MESSAGE_CACHE: dict[int, list[Message]] = defaultdict(list)
+# Pending messages per chat, logged round-robin across chats.
+MESSAGE_CACHE: dict[int, deque[Message]] = defaultdict(deque)
+
+# Chats that have pending messages, a chat is in here at most once.
+READY_CHATS: asyncio.Queue[int] = asyncio.Queue()
+
+MAX_PENDING_PER_CHAT = 100
+
+# forward_messages takes at most 100 ids.
+FORWARD_BATCH_SIZE = 100
+
+# Seconds between spool compactions, done only while the queue is idle.
+SPOOL_COMPACT_INTERVAL = 600
+
+# A batch that fails on network/server errors is retried after 30s, 60s, 120s.
+# Past that it stays in the spool and is retried on the next start.
+MAX_LOG_RETRIES = 3
+LOG_RETRY_DELAY = 30
+
+LOG_RETRIES: dict[int, int] = defaultdict(int)
+
 FLOOD_LIST: list[int] = []
 
+RECENTLY_CACHED: OrderedDict[tuple[int, int], None] = OrderedDict()
+
+
+class LogPacer:
+    """Token bucket for sends to the log chat, paused exactly as long as FloodWait asks."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.flood_waits = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.flood_waits += 1
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# Telegram allows about 20 messages a minute into a single group.
+PACER = LogPacer(rate=20 / 60, capacity=5)
+
+LOG_STATS = {"logged": 0, "failed": 0, "dropped": 0, "last_lag": 0.0, "max_lag": 0.0}
+
 
 async def init_task():
     tag_check = await LOGGER.find_one({"_id": "tag_logger_switch"})
@@ -21,6 +90,7 @@ async def init_task():
         extra_config.TAG_LOGGER = tag_check["value"]
     if pm_check:
         extra_config.PM_LOGGER = pm_check["value"]
+    Config.EXIT_TASKS.extend((SPOOL.close, ARCHIVE.close))
     Config.BACKGROUND_TASKS.append(asyncio.create_task(runner(), name="pm_tag_logger"))
 
 
@@ -55,6 +125,59 @@ async def logger_switch(bot: BOT, message: Message):
             Config.BACKGROUND_TASKS.append(asyncio.create_task(runner(), name="pm_tag_logger"))
 
 
+@bot.add_cmd(cmd="logstats")
+async def logger_stats(bot: BOT, message: Message):
+    """
+    CMD: LOGSTATS
+    INFO: View PM/Tag Logger queue and delivery stats.
+    USAGE: .logstats
+    """
+    pending = sum(len(messages) for messages in MESSAGE_CACHE.values())
+    await message.reply(
+        text=(
+            "<b>PM/Tag Logger</b>"
+            f"\n  Pending: <code>{pending}</code> in <code>{len(MESSAGE_CACHE)}</code> chats"
+            f"\n  Logged: <code>{LOG_STATS['logged']}</code>"
+            f"\n  Failed: <code>{LOG_STATS['failed']}</code>"
+            f"\n  Dropped: <code>{LOG_STATS['dropped']}</code>"
+            f"\n  Flood waits: <code>{PACER.flood_waits}</code>"
+            f"\n  Lag: <code>{LOG_STATS['last_lag']:.1f}s</code>"
+            f" (max <code>{LOG_STATS['max_lag']:.1f}s</code>)"
+        ),
+        del_in=30,
+    )
+
+
+@bot.add_cmd(cmd="logsearch")
+async def log_search(bot: BOT, message: Message):
+    """
+    CMD: LOGSEARCH
+    INFO: Search PMs and Tags saved by the PM/Tag Logger.
+    USAGE: .logsearch hello world
+    """
+    query = message.filtered_input.strip()
+
+    if not query:
+        await message.reply("Give something to search for.", del_in=8)
+        return
+
+    results = ARCHIVE.search(query)
+
+    if not results:
+        await message.reply(f"No logged messages match: <code>{escape(query)}</code>", del_in=15)
+        return
+
+    hits = [
+        f"<a href='{link}'>{escape(chat)}</a> • {escape(sender)}"
+        f" • {datetime.fromtimestamp(date):%d %b %Y}\n{snippet}"
+        for sender, chat, link, date, snippet in results
+    ]
+    await message.reply(
+        text=f"<b>Logs matching</b> <code>{escape(query)}</code>:\n\n" + "\n\n".join(hits),
+        disable_preview=True,
+    )
+
+
 BASIC_FILTERS = (
     ~filters.channel
     & ~filters.bot
@@ -71,54 +194,112 @@ BASIC_FILTERS = (
     & filters.create(lambda _, __, ___: extra_config.PM_LOGGER),
 )
 async def pm_logger(bot: BOT, message: Message):
-    cache_message(message)
+    cache_message(message, kind="pm")
 
 
 TAG_FILTER = filters.create(lambda _, __, ___: extra_config.TAG_LOGGER)
 
 
-@bot.on_message(
-    filters=(BASIC_FILTERS & filters.reply & TAG_FILTER) & ~filters.private,
-)
-async def reply_logger(bot: BOT, message: Message):
-    if (
-        message.reply_to_message
-        and message.reply_to_message.from_user
-        and message.reply_to_message.from_user.id == bot.me.id
-    ):
-        cache_message(message)
-    message.continue_propagation()
+def get_tag_pattern() -> re.Pattern | None:
+    names = [f"@{bot.me.username}"] if bot.me.username else []
+    names += extra_config.TAG_LOGGER_ALIASES
+    if not names:
+        return None
+    # Longest first so an alias that prefixes another doesn't shadow it.
+    alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
 
 
-@bot.on_message(
-    filters=(BASIC_FILTERS & filters.mentioned & TAG_FILTER) & ~filters.private,
-)
-async def mention_logger(bot: BOT, message: Message):
-    for entity in message.entities or []:
-        if entity.type == MessageEntityType.MENTION and entity.user and entity.user.id == bot.me.id:
-            cache_message(message)
-    message.continue_propagation()
+TAG_PATTERN = get_tag_pattern()
 
 
-@bot.on_message(
-    filters=(BASIC_FILTERS & (filters.text | filters.media) & TAG_FILTER) & ~filters.private,
-)
-async def username_logger(bot: BOT, message: Message):
-    text = message.text or message.caption or ""
-    if bot.me.username and f"@{bot.me.username}" in text:
-        cache_message(message)
+def is_tag(message: Message) -> bool:
+    reply = message.reply_to_message
+    if reply and reply.from_user and reply.from_user.id == bot.me.id:
+        return True
+
+    if message.mentioned:
+        for entity in message.entities or message.caption_entities or []:
+            if entity.user and entity.user.id == bot.me.id:
+                return True
+
+    text = message.text or message.caption
+    return bool(text and TAG_PATTERN and TAG_PATTERN.search(text))
+
+
+@bot.on_message(filters=(BASIC_FILTERS & TAG_FILTER) & ~filters.private)
+async def tag_logger(bot: BOT, message: Message):
+    if is_tag(message):
+        cache_message(message, kind="tag")
     message.continue_propagation()
 
 
-def cache_message(message: Message):
+def cache_message(message: Message, kind: str, spool: bool = True):
     chat_id = message.chat.id
-    if len(MESSAGE_CACHE[chat_id]) >= 10 and chat_id not in FLOOD_LIST:
-        bot.log.error(f"Message not Logged from chat: {get_name(message.chat)}")
-        FLOOD_LIST.append(chat_id)
+
+    # Same update can arrive twice, e.g. on reconnects.
+    if (chat_id, message.id) in RECENTLY_CACHED:
+        return
+    RECENTLY_CACHED[(chat_id, message.id)] = None
+    while len(RECENTLY_CACHED) > 1000:
+        RECENTLY_CACHED.popitem(last=False)
+
+    pending = MESSAGE_CACHE[chat_id]
+
+    if len(pending) >= MAX_PENDING_PER_CHAT:
+        LOG_STATS["dropped"] += 1
+        if chat_id not in FLOOD_LIST:
+            bot.log.error(f"Message not Logged from chat: {get_name(message.chat)}")
+            FLOOD_LIST.append(chat_id)
         return
+
     if chat_id in FLOOD_LIST:
         FLOOD_LIST.remove(chat_id)
-    MESSAGE_CACHE[chat_id].append(message)
+
+    if spool:
+        try:
+            SPOOL.add(chat_id=chat_id, message_id=message.id, kind=kind)
+        except Exception as e:
+            # Still logged from memory, it just won't survive a restart.
+            bot.log.error(f"PM/Tag Logger: Couldn't spool a message from {chat_id}: {e}")
+
+    if not pending:
+        READY_CHATS.put_nowait(chat_id)
+
+    pending.append(message)
+
+
+async def restore_spool():
+    """Re-queue entries left in the spool by a restart or crash."""
+    for chat_id, entries in SPOOL.pending().items():
+        enabled = {"pm": extra_config.PM_LOGGER, "tag": extra_config.TAG_LOGGER}
+        kinds = dict(entries)
+
+        for idx in range(0, len(entries), FORWARD_BATCH_SIZE):
+            message_ids = [message_id for message_id, _ in entries[idx : idx + FORWARD_BATCH_SIZE]]
+
+            try:
+                messages = await bot.get_messages(chat_id=chat_id, message_ids=message_ids)
+            except Exception:
+                # Chat no longer accessible.
+                SPOOL.ack(chat_id=chat_id, message_ids=message_ids)
+                continue
+
+            for message in messages:
+                if message.empty or not enabled[kinds[message.id]]:
+                    SPOOL.ack(chat_id=chat_id, message_ids=[message.id])
+                    continue
+                cache_message(message, kind=kinds[message.id], spool=False)
+
+
+async def send_log(func, *args, **kwargs):
+    """Pace a log chat API call and retry it once FloodWait is over."""
+    while True:
+        await PACER.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWait as e:
+            PACER.pause(e.value)
 
 
 async def runner():
@@ -126,65 +307,122 @@ async def runner():
         return
     last_pm_logged_id = 0
 
+    try:
+        await restore_spool()
+    except Exception as e:
+        bot.log.error(f"PM/Tag Logger: Couldn't restore the spool: {e}")
+
     while True:
-        cached_keys = list(MESSAGE_CACHE.keys())
-        if not cached_keys:
-            await asyncio.sleep(5)
+        if READY_CHATS.empty() and time.time() - SPOOL.compacted_at > SPOOL_COMPACT_INTERVAL:
+            await compact_storage()
+
+        # One batch per turn, busy chats go to the back of the queue.
+        chat_id = await READY_CHATS.get()
+        pending = MESSAGE_CACHE[chat_id]
+        batch = list(islice(pending, FORWARD_BATCH_SIZE))
+
+        if batch[0].chat.type == ChatType.PRIVATE:
+            log_info = last_pm_logged_id != chat_id
+            last_pm_logged_id = chat_id
+            coro = log_pm(messages=batch, log_info=log_info)
+        else:
+            coro = log_chat(messages=batch)
+
+        try:
+            await coro
+            LOG_STATS["logged"] += len(batch)
+        except (BadRequest, Forbidden) as e:
+            # Won't go through on a retry either, e.g. the source chat is gone.
+            LOG_STATS["failed"] += len(batch)
+            bot.log.error(f"PM/Tag Logger: Dropped {len(batch)} messages from {chat_id}: {e}")
+        except Exception as e:
+            last_pm_logged_id = 0
+            attempt = LOG_RETRIES[chat_id] = LOG_RETRIES[chat_id] + 1
+            bot.log.error(
+                f"PM/Tag Logger: Failed to log {len(batch)} messages from {chat_id}"
+                f" (attempt {attempt})",
+                exc_info=e,
+            )
+
+            if attempt <= MAX_LOG_RETRIES:
+                # Batch stays at the front of the chat's queue until the retry.
+                delay = LOG_RETRY_DELAY * 2 ** (attempt - 1)
+                asyncio.get_running_loop().call_later(delay, READY_CHATS.put_nowait, chat_id)
+                continue
+
+            # Not acked, the spool still has them for the next start.
+            LOG_STATS["failed"] += len(batch)
+            LOG_RETRIES.pop(chat_id, None)
+            pop_batch(chat_id=chat_id, size=len(batch))
             continue
 
-        first_key = cached_keys[0]
-        cached_list = MESSAGE_CACHE.copy()[first_key]
-        if not cached_list:
-            MESSAGE_CACHE.pop(first_key)
+        LOG_RETRIES.pop(chat_id, None)
 
-        for idx, msg in enumerate(cached_list):
-            if msg.chat.type == ChatType.PRIVATE:
+        try:
+            ARCHIVE.add([get_archive_row(message) for message in batch])
+        except Exception as e:
+            bot.log.error(f"PM/Tag Logger: Couldn't archive {len(batch)} messages: {e}")
 
-                if last_pm_logged_id != first_key:
-                    last_pm_logged_id = first_key
-                    log_info = True
-                else:
-                    log_info = False
+        lag = time.time() - batch[0].date.timestamp()
+        LOG_STATS["last_lag"] = lag
+        LOG_STATS["max_lag"] = max(LOG_STATS["max_lag"], lag)
 
-                coro = log_pm(message=msg, log_info=log_info)
+        try:
+            SPOOL.ack(chat_id=chat_id, message_ids=[message.id for message in batch])
+        except Exception as e:
+            bot.log.error(f"PM/Tag Logger: Couldn't ack {len(batch)} spooled messages: {e}")
 
-            else:
-                coro = log_chat(message=msg)
+        pop_batch(chat_id=chat_id, size=len(batch))
 
-            try:
-                await coro
-            except BaseException:
-                pass
 
-            MESSAGE_CACHE[first_key].remove(msg)
-            await asyncio.sleep(5)
+async def compact_storage():
+    """Idle time upkeep of the spool and archive, errors are logged and logging carries on."""
+    try:
+        SPOOL.compact()
+    except Exception as e:
+        # Not retried until the next interval.
+        SPOOL.compacted_at = time.time()
+        bot.log.error(f"PM/Tag Logger: Spool compaction failed: {e}")
 
-        await asyncio.sleep(15)
+    try:
+        await asyncio.to_thread(ARCHIVE.prune, days=extra_config.LOG_ARCHIVE_DAYS)
+    except Exception as e:
+        bot.log.error(f"PM/Tag Logger: Archive pruning failed: {e}")
 
 
-async def log_pm(message: Message, log_info: bool):
-    if log_info:
-        await bot.send_message(
-            chat_id=extra_config.MESSAGE_LOGGER_CHAT,
-            text=f"#PM\n{message.from_user.mention} [{message.from_user.id}]",
-            message_thread_id=extra_config.PM_LOGGER_THREAD_ID,
-        )
-    notice = (
-        f"{message.from_user.mention} [{message.from_user.id}] deleted this message."
-        f"\n\n---\n\n"
-        f"Message: \n<a href='{message.link}'>{message.chat.title or message.chat.first_name}</a> ({message.chat.id})"
-        f"\n\n---\n\n"
-        f"Caption:\n{message.caption or 'No Caption in media.'}"
-    )
-    await log_message(message=message, notice=notice, thread_id=extra_config.PM_LOGGER_THREAD_ID)
+def pop_batch(chat_id: int, size: int):
+    """Remove a handled batch and put the chat back in line if it has more."""
+    pending = MESSAGE_CACHE[chat_id]
 
+    for _ in range(size):
+        pending.popleft()
 
-async def log_chat(message: Message):
-    if message.sender_chat:
-        mention, u_id = message.sender_chat.title, message.sender_chat.id
+    if pending:
+        READY_CHATS.put_nowait(chat_id)
     else:
-        mention, u_id = message.from_user.mention, message.from_user.id
-    notice = (
+        MESSAGE_CACHE.pop(chat_id, None)
+
+
+def get_sender(message: Message) -> tuple[str, int]:
+    if message.sender_chat:
+        return message.sender_chat.title, message.sender_chat.id
+    return message.from_user.mention, message.from_user.id
+
+
+def get_archive_row(message: Message) -> tuple[str, str, str, str, float]:
+    media = f"[{message.media.value}] " if message.media else ""
+    return (
+        media + (message.text or message.caption or ""),
+        get_name(message.sender_chat or message.from_user),
+        message.chat.title or get_name(message.chat),
+        message.link,
+        message.date.timestamp(),
+    )
+
+
+def get_notice(message: Message) -> str:
+    mention, u_id = get_sender(message)
+    return (
         f"{mention} [{u_id}] deleted this message."
         f"\n\n---\n\n"
         f"Message: \n<a href='{message.link}'>{message.chat.title or message.chat.first_name}</a> ({message.chat.id})"
@@ -192,32 +430,102 @@ async def log_chat(message: Message):
         f"Caption:\n{message.caption or 'No Caption in media.'}"
     )
 
-    if message.reply_to_message:
-        await log_message(message.reply_to_message, thread_id=extra_config.TAG_LOGGER_THREAD_ID)
 
-    await log_message(
-        message=message,
-        notice=notice,
-        extra_info=f"#TAG\n{mention} [{u_id}]\nMessage: \n<a href='{message.link}'>{message.chat.title}</a> ({message.chat.id})",
+async def log_pm(messages: list[Message], log_info: bool):
+    user = messages[0].from_user
+    if log_info:
+        await send_log(
+            bot.send_message,
+            chat_id=extra_config.MESSAGE_LOGGER_CHAT,
+            text=f"#PM\n{user.mention} [{user.id}]",
+            message_thread_id=extra_config.PM_LOGGER_THREAD_ID,
+        )
+    await log_messages(
+        messages={message.id: message for message in messages},
+        notices={message.id: get_notice(message) for message in messages},
+        thread_id=extra_config.PM_LOGGER_THREAD_ID,
+    )
+
+
+async def log_chat(messages: list[Message]):
+    chat = messages[0].chat
+    to_log: dict[int, Message] = {}
+    tags = []
+
+    for message in messages:
+        if message.reply_to_message:
+            to_log[message.reply_to_message.id] = message.reply_to_message
+        to_log[message.id] = message
+
+        mention, u_id = get_sender(message)
+        tags.append(f"{mention} [{u_id}]: <a href='{message.link}'>Message</a>")
+
+    await send_log(
+        bot.send_message,
+        chat_id=extra_config.MESSAGE_LOGGER_CHAT,
+        text=f"#TAG\n{chat.title} ({chat.id})\n" + "\n".join(tags),
+        message_thread_id=extra_config.TAG_LOGGER_THREAD_ID,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
+
+    await log_messages(
+        messages=to_log,
+        notices={message.id: get_notice(message) for message in messages},
         thread_id=extra_config.TAG_LOGGER_THREAD_ID,
     )
 
 
-async def log_message(
-    message: Message,
-    notice: str | None = None,
-    extra_info: str | None = None,
-    thread_id: int = None,
-):
+async def log_messages(messages: dict[int, Message], notices: dict[int, str], thread_id: int):
+    """
+    Forward messages of a chat FORWARD_BATCH_SIZE per call.
+    Ones that didn't go through (deleted, not forwardable) are copied with a notice.
+    """
+    message_ids = sorted(messages)
+    from_peer = await bot.resolve_peer(messages[message_ids[0]].chat.id)
+    to_peer = await bot.resolve_peer(extra_config.MESSAGE_LOGGER_CHAT)
+
+    for idx in range(0, len(message_ids), FORWARD_BATCH_SIZE):
+        chunk = message_ids[idx : idx + FORWARD_BATCH_SIZE]
+        random_ids = [bot.rnd_id() for _ in chunk]
+
+        try:
+            updates = await send_log(
+                bot.invoke,
+                raw.functions.messages.ForwardMessages(
+                    from_peer=from_peer,
+                    id=chunk,
+                    random_id=random_ids,
+                    to_peer=to_peer,
+                    top_msg_id=thread_id,
+                ),
+            )
+            # Missing ids are skipped silently, only the random_ids tell which went through.
+            forwarded = {
+                update.random_id
+                for update in getattr(updates, "updates", [])
+                if isinstance(update, raw.types.UpdateMessageID)
+            }
+        except MessageIdInvalid:
+            forwarded = set()
+
+        for message_id, random_id in zip(chunk, random_ids):
+            if random_id not in forwarded:
+                await copy_message(
+                    message=messages[message_id],
+                    notice=notices.get(message_id),
+                    thread_id=thread_id,
+                )
+
+
+async def copy_message(message: Message, notice: str | None = None, thread_id: int = None):
     try:
-        logged_message: Message = await message.forward(
-            extra_config.MESSAGE_LOGGER_CHAT, message_thread_id=thread_id
+        logged_message = await send_log(
+            message.copy, extra_config.MESSAGE_LOGGER_CHAT, message_thread_id=thread_id
         )
-        if extra_info:
-            await logged_message.reply(extra_info, parse_mode=ParseMode.HTML)
-    except MessageIdInvalid:
-        logged_message = await message.copy(
-            extra_config.MESSAGE_LOGGER_CHAT, message_thread_id=thread_id
-        )
-        if notice:
-            await logged_message.reply(notice, parse_mode=ParseMode.HTML)
+    except BadRequest as e:
+        bot.log.error(f"PM/Tag Logger: Couldn't copy {message.link}: {e}")
+        return
+
+    if notice:
+        await send_log(logged_message.reply, notice, parse_mode=ParseMode.HTML)
@@ -1,5 +1,6 @@
 import asyncio
-from collections import defaultdict
+import time
+from collections import OrderedDict, deque
 
 from pyrogram import filters
 from pyrogram.enums import ChatType
@@ -10,14 +11,102 @@ from app import BOT, CustomDB, Message, bot, extra_config
 PM_USERS = CustomDB["PM_USERS"]
 PM_GUARD = CustomDB["COMMON_SETTINGS"]
 
-ALLOWED_USERS: list[int] = []
-RECENT_USERS: dict = defaultdict(int)
+
+class AllowList:
+    """Users approved to PM, kept in a set that mirrors the PM_USERS collection."""
+
+    def __init__(self):
+        self._users: set[int] = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    async def load(self):
+        # Only ids are needed, skip fetching the rest of the documents.
+        self._users = {user["_id"] async for user in PM_USERS.find({}, {"_id": 1})}
+
+    async def add(self, user_id: int) -> bool:
+        """Returns False if the user was already approved."""
+        if user_id in self._users:
+            return False
+        self._users.add(user_id)
+        await PM_USERS.insert_one({"_id": user_id})
+        return True
+
+    async def remove(self, user_id: int) -> bool:
+        """Returns False if the user wasn't approved."""
+        if user_id not in self._users:
+            return False
+        self._users.discard(user_id)
+        await PM_USERS.delete_data(user_id)
+        return True
+
+
+class SpamDetector:
+    """
+    Sliding window PM counter: keeps at most `threshold` timestamps per sender,
+    senders idle for `ttl` seconds are forgotten.
+    """
+
+    def __init__(self, threshold: int, window: int, ttl: int = 3600):
+        self.threshold = threshold
+        self.window = window
+        # Forgetting a sender before their window ends would undercount them.
+        self.ttl = max(ttl, window)
+        # Ordered by last message, least recently active first.
+        self._senders: OrderedDict[int, deque[float]] = OrderedDict()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._senders
+
+    def evict(self, now: float):
+        while self._senders and now - next(iter(self._senders.values()))[-1] >= self.ttl:
+            self._senders.popitem(last=False)
+
+    def hit(self, user_id: int) -> int:
+        """Record a PM and return how many the sender sent within the window."""
+        now = time.monotonic()
+        self.evict(now)
+
+        timestamps = self._senders.pop(user_id, None) or deque(maxlen=self.threshold)
+        timestamps.append(now)
+
+        while now - timestamps[0] > self.window:
+            timestamps.popleft()
+
+        self._senders[user_id] = timestamps
+        return len(timestamps)
+
+    def reset(self, user_id: int):
+        self._senders.pop(user_id, None)
+
+
+ALLOWED_USERS = AllowList()
+RECENT_USERS = SpamDetector(
+    threshold=extra_config.PM_SPAM_THRESHOLD, window=extra_config.PM_SPAM_WINDOW
+)
+
+
+def is_allowed(user_id: int) -> bool:
+    return user_id in ALLOWED_USERS
+
+
+async def allow(user_id: int) -> bool:
+    RECENT_USERS.reset(user_id)
+    return await ALLOWED_USERS.add(user_id)
+
+
+async def disallow(user_id: int) -> bool:
+    return await ALLOWED_USERS.remove(user_id)
 
 
 async def init_task():
     guard = (await PM_GUARD.find_one({"_id": "guard_switch"})) or {}
     extra_config.PM_GUARD = guard.get("value", False)
-    [ALLOWED_USERS.append(user_id["_id"]) async for user_id in PM_USERS.find()]
+    await ALLOWED_USERS.load()
 
 
 async def pm_permit_filter(_, __, message: Message):
@@ -28,7 +117,7 @@ async def pm_permit_filter(_, __, message: Message):
         # Chat is not Private
         or message.chat.type != ChatType.PRIVATE
         # Chat is already approved
-        or message.chat.id in ALLOWED_USERS
+        or is_allowed(message.chat.id)
         # Saved Messages
         or message.chat.id == bot.me.id
         # PM is BOT
@@ -48,35 +137,35 @@ PERMIT_FILTER = filters.create(pm_permit_filter)
 @bot.on_message(PERMIT_FILTER & filters.incoming, group=0)
 async def handle_new_pm(bot: BOT, message: Message):
     user_id = message.from_user.id
-    if RECENT_USERS[user_id] == 0:
+    RECENT_USERS.evict(time.monotonic())
+
+    if user_id not in RECENT_USERS:
         await bot.log_text(
             text=f"#PMGUARD\n{message.from_user.mention} [{user_id}] has messaged you.", type="info"
         )
-    RECENT_USERS[user_id] += 1
+    recent_count = RECENT_USERS.hit(user_id)
 
     if message.chat.is_support:
         return
 
-    if RECENT_USERS[user_id] >= 5:
+    if recent_count >= RECENT_USERS.threshold:
         await message.reply("You've been blocked for spamming.")
         await bot.block_user(user_id)
-        RECENT_USERS.pop(user_id)
+        RECENT_USERS.reset(user_id)
         await bot.log_text(
             text=f"#PMGUARD\n{message.from_user.mention} [{user_id}] has been blocked for spamming.",
             type="info",
         )
         return
-    if RECENT_USERS[user_id] % 2:
+    if recent_count % 2:
         await message.reply("You are not authorised to PM.")
 
 
 @bot.on_message(PERMIT_FILTER & filters.outgoing, group=2)
 async def auto_approve(bot: BOT, message: Message):
     message = Message(message=message)
-    ALLOWED_USERS.append(message.chat.id)
     await asyncio.gather(
-        PM_USERS.insert_one({"_id": message.chat.id}),
-        message.reply(text="Auto-Approved to PM.", del_in=5),
+        allow(message.chat.id), message.reply(text="Auto-Approved to PM.", del_in=5)
     )
 
 
@@ -113,15 +202,10 @@ async def allow_pm(bot: BOT, message: Message):
             "Unable to extract User to allow.\n<code>Give user id | Reply to a user | use in PM.</code>"
         )
         return
-    if user_id in ALLOWED_USERS:
+    if is_allowed(user_id):
         await message.reply(f"{name} is already approved.")
         return
-    ALLOWED_USERS.append(user_id)
-    RECENT_USERS.pop(user_id, 0)
-    await asyncio.gather(
-        message.reply(text=f"{name} allowed to PM.", del_in=8),
-        PM_USERS.insert_one({"_id": user_id}),
-    )
+    await asyncio.gather(message.reply(text=f"{name} allowed to PM.", del_in=8), allow(user_id))
 
 
 @bot.add_cmd(cmd="nopm")
@@ -132,12 +216,11 @@ async def no_pm(bot: BOT, message: Message):
             "Unable to extract User to Dis-allow.\n<code>Give user id | Reply to a user | use in PM.</code>"
         )
         return
-    if user_id not in ALLOWED_USERS:
+    if not is_allowed(user_id):
         await message.reply(f"{name} is not approved to PM.")
         return
-    ALLOWED_USERS.remove(user_id)
     await asyncio.gather(
-        message.reply(text=f"{name} Dis-allowed to PM.", del_in=8), PM_USERS.delete_data(user_id)
+        message.reply(text=f"{name} Dis-allowed to PM.", del_in=8), disallow(user_id)
     )
 
 
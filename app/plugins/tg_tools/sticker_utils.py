@@ -0,0 +1,257 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from pathlib import Path
+
+from app import Config, Message
+
+# Image pool workers import this by its top-level name, so they never import
+# the app package and with it the bot and db setup.
+sys.path.append(str(Path(__file__).parent / "workers"))
+
+from image_worker import resize_photo as _resize_photo  # noqa: E402
+
+# Video sticker limits: 256 KB, 3 seconds.
+MAX_VIDEO_STICKER_SIZE = 256 * 1024
+MAX_VIDEO_STICKER_DURATION = 3
+MAX_VIDEO_INPUT_SIZE = 5 * 1024 * 1024
+
+# Headroom for the webm container and encoder overshoot.
+VIDEO_BITRATE_MARGIN = 0.9
+MAX_VIDEO_BITRATE = 2000
+
+FFMPEG_THREADS = min(os.cpu_count() or 1, 4)
+
+# Concurrent ffmpeg runs, each uses FFMPEG_THREADS.
+FFMPEG_SEMAPHORE = asyncio.Semaphore(max(1, (os.cpu_count() or 1) // FFMPEG_THREADS))
+
+# Image work runs in its own processes so big decodes don't block
+# the event loop or hog the default thread pool.
+MAX_IMAGE_WORKERS = min(os.cpu_count() or 1, 4)
+
+_IMAGE_POOL: Executor | None = None
+
+
+def get_image_pool() -> Executor:
+    global _IMAGE_POOL
+
+    if _IMAGE_POOL is None:
+        try:
+            # forkserver: workers don't inherit this process's threads and locks.
+            _IMAGE_POOL = ProcessPoolExecutor(
+                max_workers=MAX_IMAGE_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+            )
+        except (ImportError, NotImplementedError, OSError, ValueError):
+            # No usable multiprocessing, e.g. Termux has no sem_open.
+            _IMAGE_POOL = ThreadPoolExecutor(
+                max_workers=MAX_IMAGE_WORKERS, thread_name_prefix="image_pool"
+            )
+
+        if shutdown_image_pool not in Config.EXIT_TASKS:
+            Config.EXIT_TASKS.append(shutdown_image_pool)
+
+    return _IMAGE_POOL
+
+
+async def shutdown_image_pool():
+    if _IMAGE_POOL is not None:
+        _IMAGE_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def discard_image_pool(pool: Executor):
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _IMAGE_POOL
+
+    if _IMAGE_POOL is pool:
+        _IMAGE_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def resize_photo(image_bytes: bytes) -> BytesIO:
+    loop = asyncio.get_running_loop()
+    pool = get_image_pool()
+
+    try:
+        resized_bytes, file_name = await loop.run_in_executor(pool, _resize_photo, image_bytes)
+    except BrokenProcessPool:
+        # A worker died (OOM, decompression bomb), don't let it fail every later kang.
+        discard_image_pool(pool)
+        raise
+
+    resized_photo = BytesIO(resized_bytes)
+    resized_photo.name = file_name
+    return resized_photo
+
+
+class VideoStickerCache:
+    """LRU of transcoded video stickers keyed by source file_unique_id."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        if key in self._data:
+            self._data.move_to_end(key)
+        return self._data.get(key)
+
+    def set(self, key: str, sticker: bytes):
+        self._data[key] = sticker
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+VIDEO_STICKER_CACHE = VideoStickerCache(max_size=64)
+
+
+def get_video_bitrate(duration: float) -> int:
+    """kbps that fits the output duration into MAX_VIDEO_STICKER_SIZE."""
+    duration = max(duration, 0.5)
+    bitrate = MAX_VIDEO_STICKER_SIZE * 8 * VIDEO_BITRATE_MARGIN / duration / 1000
+    return int(min(bitrate, MAX_VIDEO_BITRATE))
+
+
+def needs_seeking(video: bytes) -> bool:
+    """MP4/MOV with the moov atom after mdat can't be demuxed from a pipe."""
+    if video[4:8] != b"ftyp":
+        return False
+
+    offset = 0
+
+    while offset + 8 <= len(video):
+        box_size = int.from_bytes(video[offset : offset + 4], "big")
+        box_type = video[offset + 4 : offset + 8]
+
+        if box_type == b"moov":
+            return False
+        if box_type == b"mdat":
+            return True
+
+        if box_size == 1:
+            box_size = int.from_bytes(video[offset + 8 : offset + 16], "big")
+        if box_size < 8:
+            break
+
+        offset += box_size
+
+    return False
+
+
+async def run_ffmpeg(*args: str, input_data: bytes | None = None) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        *args,
+        stdin=asyncio.subprocess.DEVNULL if input_data is None else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(input_data)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to convert the video:\n{stderr.decode().strip()}")
+
+    return stdout
+
+
+async def transcode_video(source: bytes | Path, duration: float | None, ff: bool = False) -> bytes:
+    """
+    Two pass VP9: a fast analysis pass followed by a
+    bitrate constrained pass targeting the sticker size cap.
+
+    Bytes are piped through stdin, a Path is read directly
+    for inputs that need seeking. Output is read from stdout.
+    """
+    video_filter = "scale=w=512:h=512:force_original_aspect_ratio=decrease"
+
+    # Unknown duration: assume the clip fills the sticker.
+    duration = duration or MAX_VIDEO_STICKER_DURATION / 0.3
+
+    if ff:
+        video_filter += ",setpts=0.3*PTS"
+        duration *= 0.3
+
+    if isinstance(source, Path):
+        input_args, input_data = ("-i", str(source)), None
+    else:
+        input_args, input_data = ("-i", "pipe:0"), source
+
+    bitrate = get_video_bitrate(min(duration, MAX_VIDEO_STICKER_DURATION))
+
+    # libvpx only writes first pass stats to a file.
+    pass_log = Path(tempfile.gettempdir()) / f"vp9_pass_{time.time()}_{id(source)}"
+
+    try:
+        while True:
+            encode_args = (
+                *input_args,
+                *("-vf", video_filter, "-t", str(MAX_VIDEO_STICKER_DURATION), "-r", "30", "-an"),
+                *("-c:v", "libvpx-vp9", "-b:v", f"{bitrate}k", "-row-mt", "1"),
+                *("-tile-columns", "1", "-threads", str(FFMPEG_THREADS)),
+                *("-passlogfile", str(pass_log)),
+            )
+            async with FFMPEG_SEMAPHORE:
+                await run_ffmpeg(
+                    *encode_args,
+                    *("-pass", "1", "-deadline", "good", "-cpu-used", "8", "-f", "null", "-"),
+                    input_data=input_data,
+                )
+                sticker = await run_ffmpeg(
+                    *encode_args,
+                    *("-pass", "2", "-deadline", "good", "-cpu-used", "2"),
+                    *("-maxrate", f"{int(bitrate * 1.2)}k", "-bufsize", f"{bitrate * 2}k"),
+                    *("-f", "webm", "pipe:1"),
+                    input_data=input_data,
+                )
+
+            if len(sticker) <= MAX_VIDEO_STICKER_SIZE or bitrate <= 100:
+                return sticker
+
+            # Overshot the cap, retry a notch lower instead of truncating.
+            bitrate = int(bitrate * 0.75)
+    finally:
+        for log_file in pass_log.parent.glob(f"{pass_log.name}*.log"):
+            log_file.unlink(missing_ok=True)
+
+
+async def make_video_sticker(message: Message, ff: bool = False) -> BytesIO:
+    video = message.video or message.animation or message.document
+
+    if video.file_size > MAX_VIDEO_INPUT_SIZE:
+        raise MemoryError("File Size exceeds 5MB.")
+
+    cache_key = f"{video.file_unique_id}_ff" if ff else video.file_unique_id
+
+    if (sticker := VIDEO_STICKER_CACHE.get(cache_key)) is None:
+        video_file: BytesIO = await message.download(in_memory=True)
+        video_bytes = video_file.getvalue()
+        duration = getattr(video, "duration", None)
+
+        if needs_seeking(video_bytes):
+            download_path = Path("downloads") / f"{time.time()}_{message.id}"
+            input_file = download_path / "input.mp4"
+            download_path.mkdir(parents=True, exist_ok=True)
+            try:
+                input_file.write_bytes(video_bytes)
+                sticker = await transcode_video(source=input_file, duration=duration, ff=ff)
+            finally:
+                shutil.rmtree(download_path, ignore_errors=True)
+        else:
+            sticker = await transcode_video(source=video_bytes, duration=duration, ff=ff)
+
+        VIDEO_STICKER_CACHE.set(cache_key, sticker)
+
+    sticker_file = BytesIO(sticker)
+    sticker_file.name = "sticker.webm"
+    return sticker_file
@@ -0,0 +1,41 @@
+"""
+Runs inside the image process pool, keep it free of app imports:
+workers load it as a top-level module to unpickle the function.
+"""
+
+from io import BytesIO
+
+from PIL import Image
+
+STICKER_SIZE = 512
+
+# Telegram rejects static stickers over 512 KB.
+MAX_STATIC_STICKER_SIZE = 512 * 1024
+
+
+def resize_photo(image_bytes: bytes) -> tuple[bytes, str]:
+    """Runs in the pool: bytes in, bytes out to keep pickling cheap."""
+    image = Image.open(BytesIO(image_bytes))
+
+    scale = STICKER_SIZE / max(image.width, image.height)
+    new_size = (int(image.width * scale), int(image.height * scale))
+
+    # Let JPEG decode straight at 1/2, 1/4 or 1/8 scale instead of full resolution.
+    image.draft(None, new_size)
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    # reducing_gap does a cheap integer reduce() before the final LANCZOS pass.
+    image = image.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+    output = BytesIO()
+    image.save(output, format="PNG")
+
+    if output.tell() <= MAX_STATIC_STICKER_SIZE:
+        return output.getvalue(), "sticker.png"
+
+    # Photos rarely fit as PNG, WebP keeps them under the limit.
+    output = BytesIO()
+    image.save(output, format="WEBP", quality=90, method=4)
+    return output.getvalue(), "sticker.webp"